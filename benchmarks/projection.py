@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+#
+# This module is part of the GeoTag-X PyBossa plugin.
+# It contains a benchmark of the reprojection used by the GeoJSON exporter.
+#
+# Copyright (c) 2017 UNITAR/UNOSAT
+#
+# The MIT License (MIT)
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE
+# OR OTHER DEALINGS IN THE SOFTWARE.
+#
+# The benchmark reprojects synthetic geolocation answers with both the exporter's
+# original scalar routine, which is kept below as a reference, and geo.projection,
+# and checks that both drop the same coordinates and agree on the others.
+#
+# Usage: python benchmarks/projection.py [--vertices N]
+import argparse
+import imp
+import os
+import random
+import sys
+import time
+
+import numpy as np
+
+projection = imp.load_source("projection", os.path.join(os.path.dirname(__file__), "..", "geotagx", "geo", "projection.py"))
+
+TOLERANCE = 1e-9
+"""The largest difference, in degrees, between a coordinate reprojected by both routines."""
+
+
+def _project_coordinate_from_webmercator_toWGS84(coordinates):
+    """
+        Changes projection to WGS84 projection  from WebMercator projection
+        so that most geojson renderers support it out of the box
+        Inspired by : http://www.gal-systems.com/2011/07/convert-coordinates-between-web.html
+    """
+    import math
+
+    mercatorX_lon = coordinates[0]
+    mercatorY_lat = coordinates[1]
+
+    if math.fabs(mercatorX_lon) < 180 and math.fabs(mercatorY_lat) < 90:
+        return False, False
+
+    if ((math.fabs(mercatorX_lon) > 20037508.3427892) or (math.fabs(mercatorY_lat) > 20037508.3427892)):
+        return False, False
+
+    x = mercatorX_lon
+    y = mercatorY_lat
+    num3 = x / 6378137.0
+    num4 = num3 * 57.295779513082323
+    num5 = math.floor(float((num4 + 180.0) / 360.0))
+    num6 = num4 - (num5 * 360.0)
+    num7 = 1.5707963267948966 - (2.0 * math.atan(math.exp((-1.0 * y) / 6378137.0)));
+    mercatorX_lon = num6
+    mercatorY_lat = num7 * 57.295779513082323
+
+    return mercatorX_lon, mercatorY_lat
+
+
+def _project_geosummary_from_webmercator_to_WGS84(multi_polygon):
+    """
+        Changes the projection of the multi_polygon object to WGS84 from WebMercator
+    """
+    _multi_polygon = []
+    for polygon in multi_polygon:
+        _polygon = []
+        for coordinates in polygon:
+            try:
+                _x, _y = _project_coordinate_from_webmercator_toWGS84(coordinates)
+                if _x and _y:
+                    _polygon.append([_x, _y])
+            except:
+                pass # Pass Silentily if there is some error in the input
+        _multi_polygon.append(_polygon)
+    return _multi_polygon
+
+
+def build_rings(number_of_rings, number_of_vertices, malformed=False, seed=0):
+    """Builds synthetic geolocation answers.
+
+    Args:
+        number_of_rings (int): The number of rings to build.
+        number_of_vertices (int): The largest number of vertices per ring.
+        malformed (bool): If set to True, the rings also hold geographic, out-of-range,
+            short, long and non-numeric coordinates, as well as empty rings.
+        seed (int): The random number generator's seed.
+
+    Returns:
+        list: A list of rings, each of which is a list of Web Mercator coordinates.
+    """
+    generator = random.Random(seed)
+
+    def build_coordinates():
+        choice = generator.random() if malformed else 1.0
+        if choice < 0.05:
+            return [generator.uniform(-179, 179), generator.uniform(-89, 89)]
+        elif choice < 0.07:
+            return [3e7, 1.0]
+        elif choice < 0.08:
+            return [u"12", 5]
+        elif choice < 0.09:
+            return [1]
+        elif choice < 0.095:
+            return None
+        elif choice < 0.1:
+            return [generator.randint(-2 * 10 ** 7, 2 * 10 ** 7), generator.randint(-2 * 10 ** 7, 2 * 10 ** 7), 7]
+        return [generator.uniform(-2e7, 2e7), generator.uniform(-2e7, 2e7)]
+
+    rings = []
+    for _ in xrange(number_of_rings):
+        length = generator.randint(0, number_of_vertices) if malformed else number_of_vertices
+        rings.append([build_coordinates() for _ in xrange(length)])
+    if malformed:
+        rings.extend([[[0.0, 0.0]], []])
+
+    return rings
+
+
+def compare(reference, rings):
+    """Returns the largest difference between the specified reference rings and rings.
+
+    Raises:
+        AssertionError: If the rings do not hold the same number of coordinates.
+    """
+    assert len(reference) == len(rings), "the number of rings differs"
+
+    difference = 0.0
+    for reference_ring, ring in zip(reference, rings):
+        assert len(reference_ring) == len(ring), "the coordinates of {} differ".format(reference_ring)
+        if ring:
+            difference = max(difference, np.abs(np.asarray(reference_ring) - np.asarray(ring)).max())
+
+    return difference
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the reprojection used by the GeoJSON exporter.")
+    parser.add_argument("--vertices", type=int, default=10 ** 6, help="the number of vertices to reproject")
+    arguments = parser.parse_args()
+
+    print "NumPy {}".format(np.__version__)
+
+    rings = build_rings(2000, 8, malformed=True)
+    difference = compare(_project_geosummary_from_webmercator_to_WGS84(rings), projection.project_rings(rings))
+    if difference > TOLERANCE:
+        sys.exit("The coordinates differ by up to {} degrees.".format(difference))
+    print "Malformed rings: identical coordinates, within {:.3g} degrees".format(difference)
+
+    for number_of_vertices in [10, 1000]:
+        rings = build_rings(arguments.vertices // number_of_vertices, number_of_vertices)
+
+        start = time.time()
+        reference = _project_geosummary_from_webmercator_to_WGS84(rings)
+        reference_elapsed = time.time() - start
+
+        start = time.time()
+        projected = projection.project_rings(rings)
+        elapsed = time.time() - start
+
+        if compare(reference, projected) > TOLERANCE:
+            sys.exit("The coordinates differ.")
+        print "{} vertices in rings of {}: scalar {:.2f}s, vectorized {:.2f}s".format(
+            arguments.vertices, number_of_vertices, reference_elapsed, elapsed)
+
+
+if __name__ == "__main__":
+    main()
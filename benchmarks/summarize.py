@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+#
+# This module is part of the GeoTag-X PyBossa plugin.
+# It contains a benchmark of the task run aggregation used by the GeoJSON exporter.
+#
+# Copyright (c) 2017 UNITAR/UNOSAT
+#
+# The MIT License (MIT)
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE
+# OR OTHER DEALINGS IN THE SOFTWARE.
+#
+# The benchmark builds a synthetic category, then summarizes its task runs with
+# both the per-image loop that the exporter used to run over the category's
+# DataFrame and geo.summary, and checks that both produce the same summaries.
+#
+# Usage: python benchmarks/summarize.py [--task-runs N [N ...]] [--reference-limit N]
+#
+# It only requires the versions of pandas and NumPy pinned in requirements.txt.
+import argparse
+import imp
+import json
+import os
+import random
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+summary = imp.load_source("summary", os.path.join(os.path.dirname(__file__), "..", "geotagx", "geo", "summary.py"))
+
+CHUNK_SIZE = 1000
+"""The number of task runs per chunk, as read by geo.store."""
+
+
+def build_category(number_of_task_runs, number_of_projects=3, seed=0):
+    """Builds the task runs of a synthetic category.
+
+    Each task run answers a multiple choice question, a numeric question, an
+    optional question and, half of the time, a geotagging question.
+
+    Args:
+        number_of_task_runs (int): The number of task runs to build.
+        number_of_projects (int): The number of projects in the category.
+        seed (int): The random number generator's seed.
+
+    Returns:
+        list: A list of task run info objects, each tagged with a 'project_id'.
+    """
+    generator = random.Random(seed)
+    number_of_images = max(10, number_of_task_runs // 5)
+
+    task_runs = []
+    for i in xrange(number_of_task_runs):
+        task_run = {
+            u"img": u"http://example.com/%d.jpg" % generator.randrange(number_of_images),
+            u"project_id": generator.randint(1, number_of_projects),
+            u"task_id": i,
+            u"isMigrated": False,
+            u"is_damaged": generator.choice([u"Yes", u"No", u"I don't know"]),
+            u"number_of_buildings": generator.randint(0, 4),
+        }
+        if generator.random() < 0.8:
+            task_run[u"building_type"] = generator.choice([u"house", u"school", u"hospital"])
+        if generator.random() < 0.5:
+            task_run[u"location"] = [
+                [generator.uniform(-2e7, 2e7), generator.uniform(-2e7, 2e7)]
+                for _ in xrange(generator.randint(3, 6))
+            ]
+        task_runs.append(task_run)
+
+    return task_runs
+
+
+def summarize_per_image(task_runs):
+    """Summarizes the specified task runs like the exporter used to.
+
+    This is the exporter's original aggregation, which selects every image's
+    task runs, then every project's, with boolean masks over the category's
+    DataFrame. It only keeps the summaries, not the features built from them.
+
+    Args:
+        task_runs (list): A list of task run info objects, each tagged with a 'project_id'.
+
+    Returns:
+        dict: A mapping of (image URL, project identifier) pairs to summaries.
+    """
+    task_runs_info = pd.read_json(json.dumps(task_runs))
+
+    summaries = {}
+    for img_url in task_runs_info['img'].unique():
+        per_url_data = task_runs_info[task_runs_info['img'] == img_url]
+
+        for project_id in np.unique(per_url_data['project_id'].values):
+            per_url_data_project_slice = per_url_data[per_url_data['project_id'] == project_id]
+            per_summary_dict = summaries[(img_url, int(project_id))] = {
+                "total": len(per_url_data_project_slice),
+                "answers": {},
+                "geolocations": {},
+            }
+
+            for key in per_url_data_project_slice.keys():
+                if key not in summary.EXCLUDED_KEYS:
+                    values = per_url_data_project_slice[key].values
+                    geolocations = [v for v in values if type(v) == type([])]
+                    if geolocations:
+                        per_summary_dict["geolocations"][key] = geolocations
+                    else:
+                        per_summary_dict["answers"][key] = dict(per_url_data_project_slice[key].value_counts())
+
+    return summaries
+
+
+def summarize_in_chunks(task_runs):
+    """Summarizes the specified task runs with geo.summary, one chunk at a time, like geo.store does.
+
+    Unlike geo.store, the summaries are merged in memory rather than stored in Redis.
+
+    Args:
+        task_runs (list): A list of task run info objects, each tagged with a 'project_id'.
+
+    Returns:
+        dict: A mapping of (image URL, project identifier) pairs to summaries.
+    """
+    summaries = {}
+    for i in xrange(0, len(task_runs), CHUNK_SIZE):
+        for group, chunk_summary in summary.summarize(task_runs[i:i + CHUNK_SIZE]).iteritems():
+            if group in summaries:
+                summary.merge(summaries[group], chunk_summary)
+            else:
+                summaries[group] = chunk_summary
+
+    return summaries
+
+
+def normalize(summaries):
+    """Returns the specified summaries in a form that both aggregations can be compared in.
+
+    Histograms are encoded in JSON, as they are when they are exported, and empty
+    histograms are dropped since the exporter renders missing ones as empty.
+    """
+    normalized = {}
+    for group, group_summary in summaries.iteritems():
+        answers = {}
+        for key, histogram in group_summary["answers"].iteritems():
+            if histogram:
+                answers[key] = json.loads(json.dumps(dict(
+                    (answer.item() if isinstance(answer, np.generic) else answer, int(count))
+                    for answer, count in histogram.iteritems()
+                )))
+        normalized[group] = (group_summary["total"], answers, group_summary["geolocations"])
+
+    return normalized
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the task run aggregation used by the GeoJSON exporter.")
+    parser.add_argument("--task-runs", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--reference-limit", type=int, default=10000,
+                        help="the largest number of task runs that the per-image aggregation is run on")
+    arguments = parser.parse_args()
+
+    print "pandas {}, NumPy {}".format(pd.__version__, np.__version__)
+    for number_of_task_runs in arguments.task_runs:
+        task_runs = build_category(number_of_task_runs)
+
+        start = time.time()
+        summaries = summarize_in_chunks(task_runs)
+        elapsed = time.time() - start
+
+        if number_of_task_runs <= arguments.reference_limit:
+            start = time.time()
+            reference = summarize_per_image(task_runs)
+            reference_elapsed = time.time() - start
+
+            if normalize(summaries) != normalize(reference):
+                sys.exit("{} task runs: the summaries differ.".format(number_of_task_runs))
+
+            print "{:>8} task runs: per image {:8.2f}s, grouped {:8.2f}s, identical summaries".format(
+                number_of_task_runs, reference_elapsed, elapsed)
+        else:
+            print "{:>8} task runs: per image        -, grouped {:8.2f}s".format(number_of_task_runs, elapsed)
+
+
+if __name__ == "__main__":
+    main()
@@ -35,6 +35,8 @@ class GeoTagX(Plugin):
         """Initializes the GeoTag-X plugin.
         """
         from flask import current_app as app
+        from os.path import join
+        from tempfile import gettempdir
         from view.admin import blueprint as admin_blueprint
         from view.blog import blueprint as blog_blueprint
         from view.community import blueprint as community_blueprint
@@ -48,6 +50,11 @@ class GeoTagX(Plugin):
         # The plugin's default configuration.
         default_configuration = {
             "GEOTAGX_NEWSLETTER_DEBUG_EMAIL_LIST": [],
+            "GEOTAGX_NEWSLETTER_BATCH_SIZE": 50,
+            "GEOTAGX_FLUSH_TASK_RUNS_JOB_THRESHOLD": 10000,
+            "GEOTAGX_GEOJSON_EXPORT_CONCURRENCY": 4,
+            "GEOTAGX_TILE_CACHE_FOLDER": join(gettempdir(), "geotagx-tiles"),
+            "GEOTAGX_TILE_CACHE_SIZE": 256 * 1024 * 1024,
         }
         for key in default_configuration:
             if app.config.get(key, None) is None:
@@ -67,11 +74,15 @@ class GeoTagX(Plugin):
         for (handle, url_prefix) in blueprints:
             app.register_blueprint(handle, url_prefix=url_prefix)
 
+        setup_category_cache()
+        setup_geojson_summaries()
         setup_project_categories()
+        setup_schema_registry(app)
         setup_views(app)
         setup_survey(app)
         setup_sourcerer(app)
         setup_helper_functions(app)
+        setup_cover_image_cache(app)
 
 
 def setup_default_configuration(app, default_configuration):
@@ -126,6 +137,9 @@ def setup_sourcerer(app, url_prefix="/sourcerer"):
     """
     from view.sourcerer import blueprint
 
+    setup_default_configuration(app, {
+        "GEOTAGX_SOURCERER_MAX_BATCH_SIZE": 500,
+    })
     app.register_blueprint(blueprint, url_prefix=url_prefix)
 
 
@@ -139,16 +153,86 @@ def setup_helper_functions(app):
     functions = {
         "get_project_category": helper.get_project_category,
         "get_blurred_cover_image_path": helper.get_blurred_cover_image_path,
+        "get_cover_image_derivative_path": helper.get_cover_image_derivative_path,
     }
     app.jinja_env.globals.update(**functions)
 
 
+def setup_cover_image_cache(app):
+    """Sets up the cache of cover image URLs, which is invalidated when a project is modified.
+
+    Args:
+        app (werkzeug.local.LocalProxy): The current application's instance.
+    """
+    from sqlalchemy import event
+    from pybossa.model.project import Project
+    from helper import on_project_changed
+
+    setup_default_configuration(app, {
+        "GEOTAGX_COVER_IMAGE_CACHE_SIZE": 4096,
+        "GEOTAGX_COVER_IMAGE_CACHE_TTL": 300,
+    })
+
+    for identifier in ("after_update", "after_delete"):
+        if not event.contains(Project, identifier, on_project_changed):
+            event.listen(Project, identifier, on_project_changed)
+
+
+def setup_category_cache():
+    """Sets up the cache of project categories, which is invalidated when a category is modified.
+    """
+    from sqlalchemy import event
+    from sqlalchemy.orm import Session
+    from pybossa.model.category import Category
+    from helper import on_category_changed, on_session_committed, on_session_rolled_back
+
+    listeners = [
+        (Category, "after_insert", on_category_changed),
+        (Category, "after_update", on_category_changed),
+        (Category, "after_delete", on_category_changed),
+        (Session, "after_commit", on_session_committed),
+        (Session, "after_rollback", on_session_rolled_back),
+    ]
+    for (target, identifier, listener) in listeners:
+        if not event.contains(target, identifier, listener):
+            event.listen(target, identifier, listener)
+
+
+def setup_geojson_summaries():
+    """Sets up the GeoJSON exporter's summaries, which are rebuilt when a project's task runs are deleted.
+    """
+    from sqlalchemy import event
+    from sqlalchemy.orm import Session
+    from pybossa.model.task_run import TaskRun
+    from geo.store import on_task_run_deleted, on_session_committed, on_session_rolled_back
+
+    listeners = [
+        (TaskRun, "after_delete", on_task_run_deleted),
+        (Session, "after_commit", on_session_committed),
+        (Session, "after_rollback", on_session_rolled_back),
+    ]
+    for (target, identifier, listener) in listeners:
+        if not event.contains(target, identifier, listener):
+            event.listen(target, identifier, listener)
+
+
+def setup_schema_registry(app):
+    """Compiles the supported projects' schemas.
+
+    Args:
+        app (werkzeug.local.LocalProxy): The current application's instance.
+    """
+    from schema import registry
+    registry.build(app.config.get("GEOTAGX_SUPPORTED_PROJECTS_SCHEMA"))
+
+
 def setup_project_categories():
     """Sets up the default project categories.
     """
     from pybossa.core import project_repo
     from pybossa.model.category import Category
     from pybossa.cache import categories as category_cache
+    from helper import bump_category_version
 
     # TODO Move category information to a data file (e.g. a markdown file) that can be easily edited.
 
@@ -199,3 +283,4 @@ def setup_project_categories():
             project_repo.save_category(category)
 
         category_cache.reset()
+        bump_category_version()
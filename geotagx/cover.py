@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+#
+# This module is part of the GeoTag-X PyBossa plugin.
+# It contains functions that generate the derivatives of project cover images.
+#
+# Copyright (c) 2017 UNITAR/UNOSAT
+#
+# The MIT License (MIT)
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE
+# OR OTHER DEALINGS IN THE SOFTWARE.
+BLUR_KERNEL_SIZE = (7, 7)
+"""The size of the Gaussian kernel used to blur cover images."""
+
+DERIVATIVE_WIDTHS = (320, 640)
+"""The widths, in pixels, of the downscaled copies of each cover image."""
+
+WEBP_QUALITY = 80
+"""The quality of the cover images' WebP variants, from 0 to 100."""
+
+
+def get_blurred_path(thumbnail_path):
+    """Returns the path to the blurred version of the specified cover image.
+
+    Args:
+        thumbnail_path (unicode): The path to a cover image.
+
+    Returns:
+        unicode: The path to the blurred cover image, which is stored next to the original.
+    """
+    return get_derivative_path(thumbnail_path, blurred=True)
+
+
+def get_derivative_path(thumbnail_path, blurred=False, width=None, webp=False):
+    """Returns the path to a derivative of the specified cover image.
+
+    Derivatives are stored next to the original, e.g. the blurred 320 pixel wide
+    WebP variant of "cover.png" is "cover_blurred_320w.webp".
+
+    Args:
+        thumbnail_path (unicode): The path to a cover image.
+        blurred (bool): If set to True, the path to a blurred derivative is returned.
+        width (int): The derivative's width, or None if it has the original's size.
+        webp (bool): If set to True, the path to a WebP variant is returned.
+
+    Returns:
+        unicode: The path to the derivative.
+    """
+    from os.path import splitext
+
+    [filename, extension] = splitext(thumbnail_path)
+    if blurred:
+        filename += "_blurred"
+    if width:
+        filename += "_{}w".format(width)
+
+    return filename + (".webp" if webp else extension)
+
+
+def get_derivative_paths(thumbnail_path):
+    """Returns the paths to and parameters of every derivative of the specified cover image.
+
+    Derivatives that would share a path are only listed once, e.g. the WebP and
+    original-format variants of a WebP cover image, and a derivative whose path is
+    the original's, e.g. the full-size WebP variant of a WebP cover image, is not
+    listed at all.
+
+    Args:
+        thumbnail_path (unicode): The path to a cover image.
+
+    Returns:
+        list: A list of <path, blurred, width, webp> tuples.
+    """
+    derivatives = []
+    paths = set([thumbnail_path])
+    for width in (None,) + DERIVATIVE_WIDTHS:
+        for blurred in (False, True):
+            # WebP variants come first, so that they are the ones encoded with WEBP_QUALITY.
+            for webp in (True, False):
+                path = get_derivative_path(thumbnail_path, blurred, width, webp)
+                if path not in paths:
+                    paths.add(path)
+                    derivatives.append((path, blurred, width, webp))
+
+    return derivatives
+
+
+def generate_derivatives(thumbnail_filename, force=False):
+    """Generates the missing or stale derivatives of the specified cover image.
+
+    A derivative is stale if it is older than the cover image. The cover image is
+    decoded once, and only if at least one of its derivatives needs to be generated.
+
+    Args:
+        thumbnail_filename (str): The filename of a cover image.
+        force (bool): If set to True, every derivative is regenerated.
+
+    Raises:
+        IOError: If the cover image could not be read, or a derivative could not be written.
+
+    Returns:
+        int: The number of generated derivatives.
+    """
+    from os.path import getmtime, isfile
+    from cv2 import GaussianBlur, resize, INTER_AREA, IMWRITE_WEBP_QUALITY
+
+    mtime = getmtime(thumbnail_filename)
+    derivatives = [
+        (filename, blurred, width, webp)
+        for (filename, blurred, width, webp) in get_derivative_paths(thumbnail_filename)
+        if force or not isfile(filename) or getmtime(filename) < mtime
+    ]
+    if not derivatives:
+        return 0
+
+    image = read_image(thumbnail_filename)
+    blurred_image = None
+    resized_images = {}
+    for (filename, blurred, width, webp) in derivatives:
+        if width:
+            if width not in resized_images:
+                (height, original_width) = image.shape[:2]
+                if width < original_width:
+                    size = (width, max(1, int(round(height * float(width) / original_width))))
+                    resized_images[width] = resize(image, size, interpolation=INTER_AREA)
+                else:
+                    resized_images[width] = image
+            derivative = resized_images[width]
+            if blurred:
+                derivative = GaussianBlur(derivative, BLUR_KERNEL_SIZE, 0)
+        elif blurred:
+            if blurred_image is None:
+                blurred_image = GaussianBlur(image, BLUR_KERNEL_SIZE, 0)
+            derivative = blurred_image
+        else:
+            derivative = image
+
+        write_image(filename, derivative, [IMWRITE_WEBP_QUALITY, WEBP_QUALITY] if webp else None)
+
+    return len(derivatives)
+
+
+def blur(source, destination):
+    """Writes a blurred copy of the specified image.
+
+    Args:
+        source (str): The filename of the image to blur.
+        destination (str): The filename of the blurred image.
+
+    Raises:
+        IOError: If the image could not be read or written.
+    """
+    from cv2 import GaussianBlur
+
+    write_image(destination, GaussianBlur(read_image(source), BLUR_KERNEL_SIZE, 0))
+
+
+def read_image(filename):
+    """Reads the specified image.
+
+    Args:
+        filename (str): The image's filename.
+
+    Raises:
+        IOError: If the image could not be read.
+
+    Returns:
+        numpy.ndarray: The image's pixels.
+    """
+    from cv2 import imread
+
+    image = imread(filename)
+    if image is None:
+        raise IOError("Could not read the image '{}'.".format(filename))
+
+    return image
+
+
+def write_image(filename, image, parameters=None):
+    """Writes the specified image atomically.
+
+    The image is encoded into a temporary file in the destination's folder, which
+    is then renamed, so that the destination is either absent or complete.
+
+    Args:
+        filename (str): The image's filename. Its extension determines the image's format.
+        image (numpy.ndarray): The image's pixels.
+        parameters (list): The encoder's parameters, e.g. [cv2.IMWRITE_WEBP_QUALITY, 80].
+
+    Raises:
+        IOError: If the image could not be written.
+    """
+    import os
+    from cv2 import imwrite
+    from tempfile import mkstemp
+
+    [folder, basename] = os.path.split(filename)
+    [_, extension] = os.path.splitext(basename)
+
+    (descriptor, temporary_filename) = mkstemp(prefix="." + basename + ".", suffix=extension, dir=folder or ".")
+    os.close(descriptor)
+    try:
+        if not imwrite(temporary_filename, image, parameters or []):
+            raise IOError("Could not write the image '{}'.".format(filename))
+        os.chmod(temporary_filename, 0644)
+        os.rename(temporary_filename, filename)
+    except:
+        os.remove(temporary_filename)
+        raise
@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+#
+# This module is part of the GeoTag-X PyBossa plugin.
+# It contains the geometry summarization methods applied to an image's geolocation answers.
+#
+# Copyright (c) 2017 UNITAR/UNOSAT
+#
+# The MIT License (MIT)
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE
+# OR OTHER DEALINGS IN THE SOFTWARE.
+#
+# Each volunteer's geolocation answer is a ring of [x, y] vertices. A summary
+# collapses all of an image's rings into a single geometry, so that the size
+# of an export depends on the number of images rather than on the number of
+# task runs.
+import numpy as np
+import pkgutil
+
+SUMMARY_MODES = frozenset(["centroid", "hull", "union"])
+"""The supported summarization methods."""
+
+HAS_SHAPELY = pkgutil.find_loader("shapely") is not None
+"""Whether the Shapely library, which the 'union' mode requires, is installed."""
+
+
+def is_available(mode):
+    """Returns whether the specified summarization method can be used.
+
+    Args:
+        mode (str): One of SUMMARY_MODES.
+
+    Returns:
+        bool: True if the method's dependencies are installed, False otherwise.
+    """
+    return mode != "union" or HAS_SHAPELY
+
+
+def summarize(rings, mode):
+    """Collapses the specified rings into a single GeoJSON geometry.
+
+    Args:
+        rings (list): A list of rings, each of which is a list of [x, y] vertices.
+        mode (str): One of SUMMARY_MODES.
+
+    Raises:
+        ValueError: If the mode is not supported.
+
+    Returns:
+        dict | None: A GeoJSON geometry, or None if the rings have no vertices.
+    """
+    if mode == "centroid":
+        point = centroid(rings)
+        return {"type": "Point", "coordinates": point} if point is not None else None
+    elif mode == "hull":
+        hull = convex_hull(rings)
+        if hull is None:
+            return None
+        elif len(hull) < 4:
+            return {"type": "Point", "coordinates": centroid(rings)}
+        return {"type": "Polygon", "coordinates": [hull]}
+    elif mode == "union":
+        return union(rings)
+    else:
+        raise ValueError("Unsupported summary mode '{}'.".format(mode))
+
+
+def centroid(rings):
+    """Returns the area-weighted centroid of the specified rings.
+
+    Every ring's signed area and centroid are computed at once with the shoelace
+    formula. If none of the rings have an area, or if the area-weighted centroid
+    lies outside the vertices' envelope, e.g. because a self-intersecting ring's
+    signed area is close to zero, the mean of the vertices is returned instead.
+
+    Args:
+        rings (list): A list of rings, each of which is a list of [x, y] vertices.
+
+    Returns:
+        list | None: The [x, y] coordinates of the centroid, or None if the rings have no vertices.
+    """
+    vertices, ring_ids, next_vertices = _concatenate(rings)
+    if vertices is None:
+        return None
+
+    x, y = vertices[:, 0], vertices[:, 1]
+    next_x, next_y = vertices[next_vertices, 0], vertices[next_vertices, 1]
+    cross = x * next_y - next_x * y
+
+    number_of_rings = ring_ids[-1] + 1
+    double_areas = np.bincount(ring_ids, weights=cross, minlength=number_of_rings)
+    has_area = double_areas != 0
+    if not has_area.any():
+        return vertices.mean(axis=0).tolist()
+
+    centroids = np.column_stack([
+        np.bincount(ring_ids, weights=(x + next_x) * cross, minlength=number_of_rings)[has_area],
+        np.bincount(ring_ids, weights=(y + next_y) * cross, minlength=number_of_rings)[has_area],
+    ]) / (3.0 * double_areas[has_area, np.newaxis])
+
+    weights = np.abs(double_areas[has_area])
+    point = np.dot(weights, centroids) / weights.sum()
+    if not ((point >= vertices.min(axis=0)) & (point <= vertices.max(axis=0))).all():
+        return vertices.mean(axis=0).tolist()
+    return point.tolist()
+
+
+def convex_hull(rings):
+    """Returns the convex hull of the specified rings.
+
+    The hull is computed with the quickhull algorithm over the rings' distinct
+    vertices: the vertex that lies farthest outside each edge of the hull found
+    so far is added to it, and the vertices it leaves inside are discarded, each
+    step processing all remaining vertices at once. Collinear vertices are not
+    part of the hull.
+
+    Args:
+        rings (list): A list of rings, each of which is a list of [x, y] vertices.
+
+    Returns:
+        list | None: The hull's closed ring in counter-clockwise order, or None if the
+            rings have no vertices. A hull of less than three distinct vertices is degenerate.
+    """
+    vertices, _, _ = _concatenate(rings)
+    if vertices is None:
+        return None
+
+    order = np.lexsort((vertices[:, 1], vertices[:, 0]))
+    vertices = vertices[order]
+    distinct = np.ones(len(vertices), dtype=bool)
+    distinct[1:] = (vertices[1:] != vertices[:-1]).any(axis=1)
+    vertices = vertices[distinct]
+    if len(vertices) < 3:
+        return vertices.tolist()
+
+    # The lowest leftmost and highest rightmost vertices are on the hull, and split it in two chains.
+    first, last = vertices[0], vertices[-1]
+    hull = [first]
+    hull.extend(_get_hull_chain(first, last, vertices[_cross(first, last, vertices) < 0]))
+    hull.append(last)
+    hull.extend(_get_hull_chain(last, first, vertices[_cross(last, first, vertices) < 0]))
+    hull.append(first)
+
+    return np.array(hull).tolist()
+
+
+def union(rings):
+    """Returns the merged footprint of the specified rings.
+
+    This requires the Shapely library.
+
+    Args:
+        rings (list): A list of rings, each of which is a list of [x, y] vertices.
+
+    Raises:
+        ImportError: If Shapely is not installed.
+
+    Returns:
+        dict | None: A GeoJSON Polygon or MultiPolygon, or None if none of the rings is a polygon.
+    """
+    from shapely.geometry import Polygon, mapping
+    from shapely.ops import unary_union
+
+    polygons = [Polygon(ring).buffer(0) for ring in rings if len(ring) >= 3]
+    footprint = unary_union(polygons) if polygons else None
+    if footprint is None or footprint.is_empty or footprint.geom_type not in ("Polygon", "MultiPolygon"):
+        return None
+    return mapping(footprint)
+
+
+def _concatenate(rings):
+    """Concatenates the vertices of the specified rings.
+
+    Args:
+        rings (list): A list of rings, each of which is a list of [x, y] vertices.
+
+    Returns:
+        tuple: An (n, 2) array of vertices, the index of each vertex's ring, and the index of
+            each vertex's successor in its ring. All three are None if the rings have no vertices.
+    """
+    rings = [ring for ring in rings if len(ring)]
+    if not rings:
+        return None, None, None
+
+    lengths = np.array([len(ring) for ring in rings], dtype=np.intp)
+    vertices = np.concatenate([np.asarray(ring, dtype=np.float64).reshape(-1, 2) for ring in rings])
+    ring_ids = np.repeat(np.arange(len(rings)), lengths)
+
+    ends = np.cumsum(lengths)
+    next_vertices = np.arange(1, len(vertices) + 1)
+    next_vertices[ends - 1] = ends - lengths
+
+    return vertices, ring_ids, next_vertices
+
+
+def _get_hull_chain(start, end, vertices):
+    """Returns the hull's vertices between the specified hull vertices.
+
+    Args:
+        start (numpy.ndarray): A vertex of the hull.
+        end (numpy.ndarray): The next vertex of the hull found so far, in counter-clockwise order.
+        vertices (numpy.ndarray): An (n, 2) array of the vertices that lie outside the edge from start to end.
+
+    Returns:
+        list: The hull's vertices from start to end, excluded, in counter-clockwise order.
+    """
+    chain = []
+
+    # An edge is a tuple of its start, its end and the vertices outside it, and is replaced by the two
+    # edges to and from its farthest vertex. Edges are processed in order, so the chain is built in order.
+    stack = [(start, end, vertices)]
+    while stack:
+        item = stack.pop()
+        if not isinstance(item, tuple):
+            chain.append(item)
+            continue
+
+        start, end, vertices = item
+        if len(vertices):
+            farthest = vertices[np.argmin(_cross(start, end, vertices))]
+            stack.append((farthest, end, vertices[_cross(farthest, end, vertices) < 0]))
+            stack.append(farthest)
+            stack.append((start, farthest, vertices[_cross(start, farthest, vertices) < 0]))
+
+    return chain
+
+
+def _cross(o, a, b):
+    """Returns the z component of the cross product of the vectors OA and OB, for each vertex B of an (n, 2) array.
+    """
+    return (a[0] - o[0]) * (b[:, 1] - o[1]) - (a[1] - o[1]) * (b[:, 0] - o[0])
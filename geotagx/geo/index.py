@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+#
+# This module is part of the GeoTag-X PyBossa plugin.
+# It contains the spatial index used to filter exported features.
+#
+# Copyright (c) 2017 UNITAR/UNOSAT
+#
+# The MIT License (MIT)
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE
+# OR OTHER DEALINGS IN THE SOFTWARE.
+import numpy as np
+
+
+def get_envelope(coordinates):
+    """Returns the envelope of the specified GeoJSON geometry coordinates.
+
+    Args:
+        coordinates (list): A GeoJSON geometry's coordinates, e.g. a MultiPolygon's list of polygons.
+
+    Returns:
+        list: The [min x, min y, max x, max y] coordinates of the envelope, which are NaN if the
+            geometry has no positions.
+    """
+    from numbers import Real
+
+    positions = []
+    pending = [coordinates]
+    while pending:
+        item = pending.pop()
+        if len(item) >= 2 and isinstance(item[0], Real):
+            positions.append(item[:2])
+        else:
+            pending.extend(item)
+
+    if not positions:
+        return [np.nan] * 4
+
+    positions = np.asarray(positions, dtype=np.float64)
+    return positions.min(axis=0).tolist() + positions.max(axis=0).tolist()
+
+
+class GridIndex(object):
+    """A uniform grid index over the envelopes of a set of features.
+
+    Each feature is registered in every grid cell its envelope overlaps, so that
+    a bounding box query only has to consider the features registered in the
+    cells the box overlaps. Features whose envelopes overlap too many cells are
+    kept aside and always considered. The index also holds the time span of
+    each feature's contributions, so that queries can be restricted to a time
+    window.
+    """
+    def __init__(self, envelopes, first, last, cell_size=1.0, max_cells_per_feature=256):
+        """Builds the index.
+
+        Args:
+            envelopes (list): Each feature's envelope, i.e. its [min x, min y, max x, max y] coordinates.
+                An envelope that contains NaN values never matches a bounding box.
+            first (list): The time of each feature's first contribution, as an ISO 8601 string or None.
+            last (list): The time of each feature's last contribution, as an ISO 8601 string or None.
+            cell_size (float): The size of a grid cell, in degrees.
+            max_cells_per_feature (int): The number of cells a feature may be registered in before it is kept aside.
+        """
+        self.envelopes = np.asarray(envelopes, dtype=np.float64).reshape(-1, 4)
+        self.first = np.array(first, dtype=object)
+        self.last = np.array(last, dtype=object)
+        self.has_time = np.array([f is not None and l is not None for f, l in zip(first, last)], dtype=bool)
+        self.cell_size = float(cell_size)
+        self.cells = {}
+
+        finite = np.isfinite(self.envelopes).all(axis=1)
+        cells = np.zeros(self.envelopes.shape, dtype=np.int64)
+        cells[finite] = np.floor(self.envelopes[finite] / self.cell_size)
+        number_of_cells = (cells[:, 2] - cells[:, 0] + 1) * (cells[:, 3] - cells[:, 1] + 1)
+
+        self.oversized = np.nonzero(finite & (number_of_cells > max_cells_per_feature))[0].tolist()
+        for i in np.nonzero(finite & (number_of_cells <= max_cells_per_feature))[0].tolist():
+            x0, y0, x1, y1 = cells[i].tolist()
+            for cx in xrange(x0, x1 + 1):
+                for cy in xrange(y0, y1 + 1):
+                    self.cells.setdefault((cx, cy), []).append(i)
+
+    def __len__(self):
+        return len(self.envelopes)
+
+    def query(self, bbox=None, since=None, until=None):
+        """Returns the features that match the specified filters.
+
+        Args:
+            bbox (tuple): A (min x, min y, max x, max y) bounding box that a feature's envelope must intersect.
+            since (str): An ISO 8601 time before which a feature's last contribution must not be.
+            until (str): An ISO 8601 time after which a feature's first contribution must not be.
+
+        Returns:
+            numpy.ndarray: The sorted indices of the matching features.
+        """
+        if bbox is None:
+            candidates = np.arange(len(self))
+        else:
+            cells = np.floor(np.asarray(bbox, dtype=np.float64) / self.cell_size)
+            with np.errstate(invalid="ignore", over="ignore"):
+                number_of_cells = (cells[2] - cells[0] + 1) * (cells[3] - cells[1] + 1)
+            if not np.isfinite(number_of_cells) or number_of_cells > len(self.cells) or number_of_cells * 100 >= len(self):
+                # Testing every envelope at once is cheaper than visiting every cell, most of which are empty.
+                candidates = np.arange(len(self))
+            else:
+                x0, y0, x1, y1 = cells.astype(np.int64).tolist()
+                candidates = set(self.oversized)
+                for cx in xrange(x0, x1 + 1):
+                    for cy in xrange(y0, y1 + 1):
+                        candidates.update(self.cells.get((cx, cy), ()))
+                candidates = np.array(sorted(candidates), dtype=np.intp)
+
+            envelopes = self.envelopes[candidates]
+            with np.errstate(invalid="ignore"):
+                candidates = candidates[
+                    (envelopes[:, 0] <= bbox[2]) & (envelopes[:, 2] >= bbox[0]) &
+                    (envelopes[:, 1] <= bbox[3]) & (envelopes[:, 3] >= bbox[1])
+                ]
+
+        if since is not None or until is not None:
+            candidates = candidates[self.has_time[candidates]]
+            if since is not None:
+                candidates = candidates[(self.last[candidates] >= since).astype(bool)]
+            if until is not None:
+                candidates = candidates[(self.first[candidates] <= until).astype(bool)]
+
+        return candidates
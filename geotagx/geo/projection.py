@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+#
+# This module is part of the GeoTag-X PyBossa plugin.
+# It contains the Web Mercator to WGS84 reprojection used by the GeoJSON exporters.
+#
+# Copyright (c) 2017 UNITAR/UNOSAT
+#
+# The MIT License (MIT)
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE
+# OR OTHER DEALINGS IN THE SOFTWARE.
+#
+# The conversion is inspired by http://www.gal-systems.com/2011/07/convert-coordinates-between-web.html
+import numpy as np
+
+EARTH_RADIUS = 6378137.0
+"""The WGS84 ellipsoid's semi-major axis, in meters."""
+
+MERCATOR_EXTENT = 20037508.3427892
+"""The largest absolute Web Mercator coordinate, in meters."""
+
+
+def to_wgs84(x, y):
+    """Converts Web Mercator coordinates to WGS84 longitudes and latitudes.
+
+    A coordinate is only valid if it is not already geographic (i.e. its longitude
+    and latitude are within [-180, 180] and [-90, 90]), lies within the Web Mercator
+    extent and does not project onto a zero longitude or latitude.
+
+    Args:
+        x (numpy.ndarray): An array of Web Mercator x coordinates.
+        y (numpy.ndarray): An array of Web Mercator y coordinates.
+
+    Returns:
+        tuple: The longitudes, latitudes and a boolean mask of the valid coordinates.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+
+    with np.errstate(invalid="ignore"):
+        ax = np.fabs(x)
+        ay = np.fabs(y)
+        valid = ~((ax < 180) & (ay < 90)) & ~((ax > MERCATOR_EXTENT) | (ay > MERCATOR_EXTENT))
+
+        longitude = np.degrees(x / EARTH_RADIUS)
+        longitude -= np.floor((longitude + 180.0) / 360.0) * 360.0
+        latitude = np.degrees(np.pi / 2.0 - 2.0 * np.arctan(np.exp(-y / EARTH_RADIUS)))
+
+        valid &= (longitude != 0) & (latitude != 0)
+
+    return longitude, latitude, valid
+
+
+def project_rings(rings):
+    """Changes the projection of the specified rings from Web Mercator to WGS84.
+
+    All the rings' coordinates are converted at once. Coordinates that are not
+    a pair of numbers or are not valid (see to_wgs84) are dropped, but a ring
+    is always kept, even if none of its coordinates are valid.
+
+    Args:
+        rings (list): A list of rings, e.g. a polygon's coordinates, where each ring is a list of [x, y] coordinates.
+
+    Returns:
+        list: The list of rings in WGS84.
+    """
+    if not rings:
+        return []
+
+    # Well-formed rings are converted with a single array allocation, and one ring at a time otherwise.
+    vertices = _to_vertices([coordinates for ring in rings for coordinates in ring], strict=True)
+    if vertices is not None:
+        lengths = np.array([len(ring) for ring in rings], dtype=np.intp)
+    else:
+        vertices = [_to_vertices(ring) for ring in rings]
+        lengths = np.array([len(v) for v in vertices], dtype=np.intp)
+        vertices = np.concatenate(vertices)
+
+    longitude, latitude, valid = to_wgs84(vertices[:, 0], vertices[:, 1])
+    projected = np.column_stack((longitude, latitude))[valid]
+
+    # Each ring's boundaries in the array of valid coordinates.
+    ends = np.concatenate(([0], np.cumsum(valid)))[np.cumsum(lengths)]
+    starts = np.concatenate(([0], ends[:-1]))
+    return [projected[start:end].tolist() for start, end in zip(starts, ends)]
+
+
+def _to_vertices(ring, strict=False):
+    """Returns the specified ring's coordinates as an (n, 2) array of floats.
+
+    Args:
+        ring (list): A list of [x, y] coordinates.
+        strict (bool): If set to True, None is returned unless every coordinate is a pair of numbers.
+
+    Returns:
+        numpy.ndarray | None: The ring's numeric coordinates. Coordinates that are not a pair
+            of numbers are dropped.
+    """
+    from numbers import Real
+
+    vertices = np.asarray(ring)
+    if vertices.ndim == 2 and vertices.shape[1] == 2 and vertices.dtype.kind in "biuf":
+        return vertices.astype(np.float64)
+    elif strict:
+        return np.empty((0, 2), dtype=np.float64) if vertices.size == 0 else None
+
+    # The ring contains coordinates of different lengths or types.
+    vertices = []
+    for coordinates in ring:
+        try:
+            x, y = coordinates[0], coordinates[1]
+        except (TypeError, IndexError, KeyError):
+            continue
+        if isinstance(x, Real) and isinstance(y, Real):
+            vertices.append((x, y))
+
+    return np.array(vertices, dtype=np.float64).reshape(-1, 2)
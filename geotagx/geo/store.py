@@ -0,0 +1,455 @@
+# -*- coding: utf-8 -*-
+#
+# This module is part of the GeoTag-X PyBossa plugin.
+# It contains the materialized, incrementally updated per-image summaries of each project.
+#
+# Copyright (c) 2017 UNITAR/UNOSAT
+#
+# The MIT License (MIT)
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE
+# OR OTHER DEALINGS IN THE SOFTWARE.
+#
+# A project's summaries are stored in a Redis hash that maps image URLs to
+# JSON-encoded summaries (see geo.summary.summarize), alongside a high-water
+# mark below which every task run is known to be summarized. Task runs are
+# assigned an identifier when they are inserted rather than when they are
+# committed, so the mark is kept a safety window behind the latest task run,
+# and the identifiers of the task runs summarized past it are recorded to
+# prevent the window, which is re-read on each update, from being merged twice.
+#
+# Every write is made in a transaction that is discarded if the summaries'
+# state changed since it was read. An update whose lock expired, or that
+# raced a reset, therefore never merges a task run twice.
+#
+# The keys are versioned, and change whenever the summaries' format does, so
+# that summaries in an older format are rebuilt rather than merged into.
+import json
+
+SUMMARY_KEY = "GEOTAGX-GEOJSON-SUMMARY-V3:{}"
+"""The key to the Redis hash that holds a project's summaries."""
+
+STATE_KEY = "GEOTAGX-GEOJSON-SUMMARY-STATE-V3:{}"
+"""The key to the Redis hash that holds the state of a project's summaries: their high-water mark ('mark'),
+the identifier of the last task run summarized ('last'), the number of task runs summarized ('count'),
+and the number of times the summaries were changed ('generation') and reset ('epoch')."""
+
+SEEN_KEY = "GEOTAGX-GEOJSON-SUMMARY-SEEN-V3:{}"
+"""The key to the Redis sorted set that holds the identifiers of the summarized task runs past a project's high-water mark."""
+
+REBUILD_SUFFIX = ":REBUILD"
+"""The suffix of the keys that a project's summaries are rebuilt in."""
+
+LEGACY_KEYS = [
+    ("GEOTAGX-GEOJSON-SUMMARY:{}", "GEOTAGX-GEOJSON-SUMMARY-MARK"),
+    ("GEOTAGX-GEOJSON-SUMMARY-V2:{}", "GEOTAGX-GEOJSON-SUMMARY-MARK-V2"),
+]
+"""The keys to the summaries and high-water marks of previous versions. The first do not record
+the finish times of their first and last task runs, and both may miss task runs that were
+committed out of order."""
+
+LOCK_KEY = "GEOTAGX-GEOJSON-SUMMARY-LOCK:{}"
+"""The key to the lock that serializes updates to a project's summaries."""
+
+LOCK_TIMEOUT = 600
+"""The number of seconds after which a lock is released, should its holder fail to release it."""
+
+TASK_RUN_CHUNK_SIZE = 1000
+"""The number of task runs that are read from the database and summarized at a time."""
+
+MARK_SAFETY_WINDOW = 10000
+"""The number of task run identifiers that a high-water mark is kept behind the latest task run."""
+
+
+def update(project_id):
+    """Merges the task runs that were submitted since the last update into the project's summaries.
+
+    If the summaries turn out to miss task runs that precede their high-water
+    mark, e.g. task runs that were committed past the safety window, they are
+    rebuilt instead.
+
+    Args:
+        project_id (int): A project's unique identifier.
+    """
+    from pybossa.core import sentinel
+
+    with sentinel.master.lock(LOCK_KEY.format(project_id), timeout=LOCK_TIMEOUT):
+        if not _update(project_id):
+            _rebuild(project_id)
+
+
+def rebuild(project_id):
+    """Rebuilds the project's summaries from all of its task runs.
+
+    The summaries are rebuilt aside, then swapped in, so that the current
+    summaries remain available until then.
+
+    Args:
+        project_id (int): A project's unique identifier.
+    """
+    from pybossa.core import sentinel
+
+    with sentinel.master.lock(LOCK_KEY.format(project_id), timeout=LOCK_TIMEOUT):
+        _rebuild(project_id)
+
+
+def reset(project_id):
+    """Removes the project's summaries, e.g. after its task runs were deleted.
+
+    Args:
+        project_id (int): A project's unique identifier.
+    """
+    from pybossa.core import sentinel
+
+    state_key = STATE_KEY.format(project_id)
+
+    # An update or rebuild in progress would otherwise write the summaries of the deleted task runs back.
+    with sentinel.master.lock(LOCK_KEY.format(project_id), timeout=LOCK_TIMEOUT):
+        pipeline = sentinel.master.pipeline()
+        pipeline.delete(SUMMARY_KEY.format(project_id), SEEN_KEY.format(project_id))
+        pipeline.hdel(state_key, "mark", "last", "count")
+        pipeline.hincrby(state_key, "generation", 1)
+        pipeline.hincrby(state_key, "epoch", 1)
+        _delete_legacy_keys(pipeline, project_id)
+        pipeline.execute()
+
+
+def load(project_id):
+    """Returns the project's summaries.
+
+    Args:
+        project_id (int): A project's unique identifier.
+
+    Returns:
+        dict: A mapping of image URLs to summaries.
+    """
+    return load_many([project_id])[0]
+
+
+def load_many(project_ids):
+    """Returns the summaries of the specified projects, which are read in a single round trip.
+
+    Args:
+        project_ids (list): A list of project identifiers.
+
+    Returns:
+        list: Each project's mapping of image URLs to summaries, in the same order as the identifiers.
+    """
+    from pybossa.core import sentinel
+
+    pipeline = sentinel.master.pipeline(transaction=False)
+    for project_id in project_ids:
+        pipeline.hgetall(SUMMARY_KEY.format(project_id))
+
+    return [
+        {img_url.decode("utf-8"): json.loads(summary) for img_url, summary in summaries.iteritems()}
+        for summaries in pipeline.execute()
+    ]
+
+
+def get_versions(project_ids):
+    """Returns the version of each of the specified projects' summaries.
+
+    Args:
+        project_ids (list): A list of project identifiers.
+
+    Returns:
+        list: The version of each project's summaries, which changes whenever they do.
+    """
+    from pybossa.core import sentinel
+
+    pipeline = sentinel.master.pipeline(transaction=False)
+    for project_id in project_ids:
+        pipeline.hmget(STATE_KEY.format(project_id), ["generation", "last", "count"])
+
+    return [[int(value or 0) for value in state] for state in pipeline.execute()]
+
+
+def find_outdated(project_ids):
+    """Finds the projects whose summaries do not reflect their task runs.
+
+    A project's summaries are compared to its task runs by the identifier of the
+    latest task run and the number of task runs, which requires a single query.
+
+    Args:
+        project_ids (list): A list of project identifiers.
+
+    Returns:
+        tuple: The identifiers of the projects whose summaries are missing task runs and
+            need to be updated, and of those whose summaries hold deleted task runs and
+            need to be rebuilt.
+    """
+    from sqlalchemy import func
+    from pybossa.core import db, sentinel
+    from pybossa.model.task_run import TaskRun
+
+    if not project_ids:
+        return [], []
+
+    task_runs = dict.fromkeys(project_ids, (0, 0))
+    query = db.session \
+        .query(TaskRun.project_id, func.max(TaskRun.id), func.count(TaskRun.id)) \
+        .filter(TaskRun.project_id.in_(project_ids)) \
+        .group_by(TaskRun.project_id)
+    for (project_id, last, count) in query:
+        task_runs[project_id] = (last, count)
+
+    pipeline = sentinel.master.pipeline(transaction=False)
+    for project_id in project_ids:
+        pipeline.hmget(STATE_KEY.format(project_id), ["last", "count"])
+
+    outdated, invalid = [], []
+    for project_id, state in zip(project_ids, pipeline.execute()):
+        last, count = task_runs[project_id]
+        summarized_last, summarized_count = [int(value or 0) for value in state]
+        if count < summarized_count or last < summarized_last:
+            invalid.append(project_id)
+        elif count > summarized_count or last > summarized_last:
+            outdated.append(project_id)
+
+    return outdated, invalid
+
+
+def on_task_run_deleted(mapper, connection, task_run):
+    """Marks the session that deleted a task run.
+
+    This is a listener for the TaskRun model's after_delete mapper event. The
+    summaries of the task run's project are rebuilt once the session's changes
+    are committed.
+    """
+    from sqlalchemy.orm import object_session
+
+    session = object_session(task_run)
+    if session is not None:
+        session.info.setdefault("geotagx_deleted_task_runs", set()).add(task_run.project_id)
+
+
+def on_session_committed(session):
+    """Schedules the rebuild of the summaries of each project whose task runs the committed session deleted.
+
+    This is a listener for the SQLAlchemy Session's after_commit event.
+    """
+    from ..jobs import enqueue_geojson_summaries_update
+
+    for project_id in session.info.pop("geotagx_deleted_task_runs", ()):
+        enqueue_geojson_summaries_update(project_id, rebuild=True)
+
+
+def on_session_rolled_back(session):
+    """Discards the task run deletions of a session that was rolled back.
+
+    This is a listener for the SQLAlchemy Session's after_rollback event.
+    """
+    session.info.pop("geotagx_deleted_task_runs", None)
+
+
+def _rebuild(project_id):
+    """Rebuilds the project's summaries aside, then swaps them in.
+
+    The caller must hold the project's lock.
+
+    Args:
+        project_id (int): A project's unique identifier.
+    """
+    from pybossa.core import sentinel
+
+    store_id = "{}{}".format(project_id, REBUILD_SUFFIX)
+    sentinel.master.delete(SUMMARY_KEY.format(store_id), STATE_KEY.format(store_id), SEEN_KEY.format(store_id))
+    _update(project_id, store_id)
+    _swap(project_id, store_id)
+
+
+def _update(project_id, store_id=None):
+    """Merges the project's unsummarized task runs into its summaries.
+
+    The caller must hold the project's lock.
+
+    Args:
+        project_id (int): A project's unique identifier.
+        store_id (str): The identifier the summaries are stored under, if it is not the project's.
+
+    Returns:
+        bool: True if the summaries hold every task run up to the last one they summarize, False
+            if they are missing task runs or hold deleted ones, or were reset in the meantime.
+    """
+    from sqlalchemy import func
+    from pybossa.core import db, sentinel
+    from pybossa.model.task_run import TaskRun
+
+    store_id = project_id if store_id is None else store_id
+
+    mark, epoch = sentinel.master.hmget(STATE_KEY.format(store_id), ["mark", "epoch"])
+    if mark is None:
+        pipeline = sentinel.master.pipeline()
+        _delete_legacy_keys(pipeline, project_id)
+        pipeline.execute()
+
+    # The task runs up to the horizon are assumed to be committed by the time they are read.
+    horizon = (db.session.query(func.max(TaskRun.id)).scalar() or 0) - MARK_SAFETY_WINDOW
+
+    for task_runs in _read_task_runs(project_id, int(mark or 0)):
+        if not _merge_task_runs(project_id, store_id, epoch, task_runs, min(horizon, task_runs[-1].id)):
+            return False
+
+    if not _merge_task_runs(project_id, store_id, epoch, [], horizon):
+        return False
+
+    last, count = [int(value or 0) for value in sentinel.master.hmget(STATE_KEY.format(store_id), ["last", "count"])]
+    return count == TaskRun.query.filter(TaskRun.project_id == project_id, TaskRun.id <= last).count()
+
+
+def _merge_task_runs(project_id, store_id, epoch, task_runs, mark):
+    """Merges the specified task runs into the project's summaries, and moves their high-water mark.
+
+    The task runs that were already summarized are skipped. The summaries are
+    only written if their state did not change in the meantime, and are read
+    again otherwise.
+
+    Args:
+        project_id (int): A project's unique identifier.
+        store_id (str): The identifier the summaries are stored under.
+        epoch (str): The epoch of the summaries that the task runs were read for.
+        task_runs (list): A list of task run rows, as read by _read_task_runs.
+        mark (int): The identifier up to which every task run of the project is summarized
+            once the task runs are merged.
+
+    Returns:
+        bool: True if the task runs were merged, False if the summaries were reset in the meantime.
+    """
+    from redis.exceptions import WatchError
+    from pybossa.core import sentinel
+    from .summary import summarize, merge
+
+    key = SUMMARY_KEY.format(store_id)
+    state_key = STATE_KEY.format(store_id)
+    seen_key = SEEN_KEY.format(store_id)
+
+    with sentinel.master.pipeline() as pipeline:
+        while True:
+            try:
+                pipeline.watch(state_key, seen_key)
+                current_epoch, current_mark, last = pipeline.hmget(state_key, ["epoch", "mark", "last"])
+                if current_epoch != epoch:
+                    return False
+
+                current_mark, last = int(current_mark or 0), int(last or 0)
+                seen = set()
+                if task_runs:
+                    seen = {int(i) for i in pipeline.zrangebyscore(seen_key, task_runs[0].id, task_runs[-1].id)}
+                rows = [row for row in task_runs if row.id > current_mark and row.id not in seen]
+
+                # Answers are compared once they are encoded since JSON object keys are always strings.
+                infos = [
+                    dict(row.info, project_id=project_id, finish_time=row.finish_time)
+                    for row in rows if isinstance(row.info, dict)
+                ]
+                summaries = {img_url: json.loads(json.dumps(summary)) for (img_url, _), summary in summarize(infos).iteritems()}
+
+                img_urls = summaries.keys()
+                stored_summaries = pipeline.hmget(key, img_urls) if img_urls else []
+                for img_url, stored_summary in zip(img_urls, stored_summaries):
+                    if stored_summary is not None:
+                        summaries[img_url] = merge(json.loads(stored_summary), summaries[img_url])
+
+                pipeline.multi()
+                if summaries:
+                    pipeline.hmset(key, {img_url: json.dumps(summary) for img_url, summary in summaries.iteritems()})
+                if rows:
+                    pipeline.zadd(seen_key, *[value for row in rows for value in (row.id, row.id)])
+                    pipeline.hset(state_key, "last", max(last, rows[-1].id))
+                    pipeline.hincrby(state_key, "count", len(rows))
+                    pipeline.hincrby(state_key, "generation", 1)
+                if mark > current_mark:
+                    pipeline.hset(state_key, "mark", mark)
+                    pipeline.zremrangebyscore(seen_key, "-inf", mark)
+                pipeline.execute()
+                return True
+            except WatchError:
+                continue
+
+
+def _swap(project_id, store_id):
+    """Replaces the project's summaries with those stored under the specified identifier.
+
+    Args:
+        project_id (int): A project's unique identifier.
+        store_id (str): The identifier the new summaries are stored under.
+    """
+    from redis.exceptions import WatchError
+    from pybossa.core import sentinel
+
+    keys = [SUMMARY_KEY.format(project_id), SEEN_KEY.format(project_id)]
+    new_keys = [SUMMARY_KEY.format(store_id), SEEN_KEY.format(store_id)]
+    state_key, new_state_key = STATE_KEY.format(project_id), STATE_KEY.format(store_id)
+
+    with sentinel.master.pipeline() as pipeline:
+        while True:
+            try:
+                pipeline.watch(state_key)
+                generation, epoch = pipeline.hmget(state_key, ["generation", "epoch"])
+                state = pipeline.hgetall(new_state_key)
+                state.update(generation=int(generation or 0) + 1, epoch=int(epoch or 0) + 1)
+                renamed_keys = [(k, new_k) for (k, new_k) in zip(keys, new_keys) if pipeline.exists(new_k)]
+
+                pipeline.multi()
+                pipeline.delete(state_key, *keys)
+                for (k, new_k) in renamed_keys:
+                    pipeline.rename(new_k, k)
+                pipeline.hmset(state_key, state)
+                pipeline.delete(new_state_key)
+                pipeline.execute()
+                return
+            except WatchError:
+                continue
+
+
+def _delete_legacy_keys(pipeline, project_id):
+    """Queues the deletion of the project's summaries and high-water mark of previous versions.
+
+    Args:
+        pipeline (redis.client.StrictPipeline): The pipeline to queue the commands in.
+        project_id (int): A project's unique identifier.
+    """
+    for summary_key, mark_key in LEGACY_KEYS:
+        pipeline.delete(summary_key.format(project_id))
+        pipeline.hdel(mark_key, project_id)
+
+
+def _read_task_runs(project_id, mark):
+    """Reads the project's task runs that follow the specified high-water mark, in chunks of TASK_RUN_CHUNK_SIZE.
+
+    Args:
+        project_id (int): A project's unique identifier.
+        mark (int): The identifier up to which every task run of the project is summarized.
+
+    Yields:
+        list: A chunk of task run rows, each of which holds a task run's identifier ('id'),
+            info ('info') and finish time ('finish_time'), in the order of their identifiers.
+    """
+    from itertools import islice
+    from pybossa.model.task_run import TaskRun
+
+    query = TaskRun.query \
+        .filter(TaskRun.project_id == project_id, TaskRun.id > mark) \
+        .order_by(TaskRun.id) \
+        .with_entities(TaskRun.id, TaskRun.info, TaskRun.finish_time)
+    rows = iter(query.yield_per(TASK_RUN_CHUNK_SIZE))
+
+    chunk = list(islice(rows, TASK_RUN_CHUNK_SIZE))
+    while chunk:
+        yield chunk
+        chunk = list(islice(rows, TASK_RUN_CHUNK_SIZE))
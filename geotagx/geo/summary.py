@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+#
+# This module is part of the GeoTag-X PyBossa plugin.
+# It contains the aggregation engine that summarizes task runs per image.
+#
+# Copyright (c) 2017 UNITAR/UNOSAT
+#
+# The MIT License (MIT)
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE
+# OR OTHER DEALINGS IN THE SOFTWARE.
+EXCLUDED_KEYS = frozenset([u"img", u"isMigrated", u"son_app_id", u"task_id", u"project_id", u"finish_time"])
+"""Task run keys that do not hold a volunteer's answer."""
+
+
+def summarize(task_runs):
+    """Summarizes the specified task runs per image and project.
+
+    The task runs are grouped by (img, project_id) once, after which every
+    question's answer histogram and the number of task runs are computed for
+    all groups in a single grouped aggregation per column. Answers that are
+    lists (i.e. geolocations) cannot be counted and are collected instead.
+
+    Args:
+        task_runs (list): A list of task run info objects, each tagged with a 'project_id'
+            and, optionally, a 'finish_time'.
+
+    Returns:
+        dict: A mapping of (image URL, project identifier) pairs to summaries. Each summary
+            holds the number of task runs ('total'), a histogram of each question's answers
+            ('answers'), a list of each question's geolocation answers ('geolocations') and
+            the finish times of the first and last task runs ('first' and 'last').
+    """
+    import pandas as pd
+    import numpy as np
+
+    task_runs_info = pd.DataFrame(task_runs)
+    if u"img" not in task_runs_info or u"project_id" not in task_runs_info:
+        return {}
+
+    group_keys = [u"img", u"project_id"]
+
+    summaries = {}
+    for (img_url, project_id), total in task_runs_info.groupby(group_keys, sort=False).size().iteritems():
+        summaries[(img_url, int(project_id))] = {
+            "total": int(total),
+            "answers": {},
+            "geolocations": {},
+            "first": None,
+            "last": None,
+        }
+
+    # Each task run's group is also encoded as a single integer, so that the task runs of
+    # a set of groups can be selected with vectorized operations. Ungrouped task runs are -1.
+    img_codes, img_urls = pd.factorize(task_runs_info[u"img"].values)
+    project_codes, project_ids = pd.factorize(task_runs_info[u"project_id"].values)
+    group_codes = img_codes * len(project_ids) + project_codes
+    group_codes[(img_codes < 0) | (project_codes < 0)] = -1
+
+    if u"finish_time" in task_runs_info:
+        finish_times = task_runs_info[group_keys + [u"finish_time"]].dropna(subset=[u"finish_time"])
+        if not finish_times.empty:
+            grouped = finish_times.groupby(group_keys, sort=False)[u"finish_time"]
+            for (img_url, project_id), first in grouped.min().iteritems():
+                summaries[(img_url, int(project_id))]["first"] = first
+            for (img_url, project_id), last in grouped.max().iteritems():
+                summaries[(img_url, int(project_id))]["last"] = last
+
+    for key in task_runs_info.columns:
+        if key in EXCLUDED_KEYS:
+            continue
+
+        column = task_runs_info[key]
+        answers = task_runs_info[group_keys + [key]]
+
+        # Only a column of Python objects can hold lists.
+        is_geolocation = None
+        if column.dtype == object:
+            is_geolocation = column.map(type).values == list
+
+        if is_geolocation is not None and is_geolocation.any():
+            # The geolocations are sorted by group, without reordering a group's own, then sliced.
+            geolocated_codes = group_codes[is_geolocation]
+            order = np.argsort(geolocated_codes, kind="mergesort")
+            geolocated_codes = geolocated_codes[order]
+            geolocations = column.values[is_geolocation][order]
+
+            starts = np.flatnonzero(np.r_[True, geolocated_codes[1:] != geolocated_codes[:-1]])
+            for start, end in zip(starts, np.r_[starts[1:], len(geolocated_codes)]):
+                code = geolocated_codes[start]
+                if code >= 0:
+                    group = (img_urls[code // len(project_ids)], int(project_ids[code % len(project_ids)]))
+                    summaries[group]["geolocations"][key] = geolocations[start:end].tolist()
+
+            # A group that contains a geolocation is not counted, much like a group that contains none is not collected.
+            answers = answers[~np.in1d(group_codes, group_codes[is_geolocation])]
+
+        answers = answers[answers[key].notnull().values]
+        if answers.empty:
+            continue
+
+        for (img_url, project_id, answer), count in answers.groupby(group_keys + [key], sort=False).size().iteritems():
+            answer = answer.item() if isinstance(answer, np.generic) else answer
+            summaries[(img_url, int(project_id))]["answers"].setdefault(key, {})[answer] = int(count)
+
+    return summaries
+
+
+def merge(summary, other):
+    """Merges a summary into another.
+
+    Args:
+        summary (dict): The summary to update.
+        other (dict): The summary to merge into 'summary'.
+
+    Returns:
+        dict: The updated summary.
+    """
+    summary["total"] += other["total"]
+
+    for key, histogram in other["answers"].iteritems():
+        merged_histogram = summary["answers"].setdefault(key, {})
+        for answer, count in histogram.iteritems():
+            merged_histogram[answer] = merged_histogram.get(answer, 0) + count
+
+    for key, geolocations in other["geolocations"].iteritems():
+        summary["geolocations"].setdefault(key, []).extend(geolocations)
+
+    times = [t for t in (summary.get("first"), other.get("first")) if t is not None]
+    summary["first"] = min(times) if times else None
+    times = [t for t in (summary.get("last"), other.get("last")) if t is not None]
+    summary["last"] = max(times) if times else None
+
+    return summary
@@ -0,0 +1,325 @@
+# -*- coding: utf-8 -*-
+#
+# This module is part of the GeoTag-X PyBossa plugin.
+# It contains the tiling of GeoJSON features into z/x/y map tiles, and the tiles' disk cache.
+#
+# Copyright (c) 2017 UNITAR/UNOSAT
+#
+# The MIT License (MIT)
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE
+# OR OTHER DEALINGS IN THE SOFTWARE.
+#
+# Tiles follow the XYZ ("slippy map") scheme: at zoom level z, the Web Mercator
+# world is divided into 2^z by 2^z tiles of 256 pixels, numbered from the
+# north-west corner. A tile holds the features that intersect it, clipped to
+# its bounds and simplified to its resolution. Its rings are closed, i.e. their
+# last position repeats their first, as GeoJSON requires.
+from collections import OrderedDict
+from threading import Lock
+import math
+import numpy as np
+
+TILE_SIZE = 256
+"""A tile's width and height, in pixels."""
+
+MAX_ZOOM = 22
+"""The highest zoom level that is served."""
+
+
+def get_tile_bounds(z, x, y):
+    """Returns the bounds of the specified tile.
+
+    Args:
+        z (int): The tile's zoom level.
+        x (int): The tile's column.
+        y (int): The tile's row.
+
+    Returns:
+        tuple: The tile's (west, south, east, north) bounds, in degrees.
+    """
+    n = 2.0 ** z
+
+    def latitude(row):
+        return math.degrees(math.atan(math.sinh(math.pi * (1.0 - 2.0 * row / n))))
+
+    return (x / n * 360.0 - 180.0, latitude(y + 1), (x + 1) / n * 360.0 - 180.0, latitude(y))
+
+
+def get_tolerance(z):
+    """Returns the simplification tolerance at the specified zoom level.
+
+    Args:
+        z (int): A zoom level.
+
+    Returns:
+        float: The width of a pixel at the equator, in degrees.
+    """
+    return 360.0 / (2 ** z) / TILE_SIZE
+
+
+def simplify_ring(ring, tolerance):
+    """Simplifies the specified ring by snapping it to a grid.
+
+    Vertices are snapped to a grid whose cells are 'tolerance' wide, and consecutive
+    vertices that fall in the same cell are merged.
+
+    Args:
+        ring (numpy.ndarray): An (n, 2) array of vertices.
+        tolerance (float): The width of a grid cell.
+
+    Returns:
+        numpy.ndarray | None: The simplified ring, closed, or None if it collapsed to less than four positions.
+    """
+    snapped = np.round(ring / tolerance) * tolerance
+    keep = np.ones(len(snapped), dtype=bool)
+    keep[1:] = (snapped[1:] != snapped[:-1]).any(axis=1)
+    return close_ring(snapped[keep])
+
+
+def clip_ring(ring, bounds):
+    """Clips the specified ring to the specified bounds.
+
+    The ring is clipped against each of the bounds' four edges in turn
+    (Sutherland-Hodgman), each edge being processed for all vertices at once.
+
+    Args:
+        ring (numpy.ndarray): An (n, 2) array of vertices.
+        bounds (tuple): The (west, south, east, north) bounds to clip the ring to.
+
+    Returns:
+        numpy.ndarray | None: The clipped ring, closed, or None if it lies outside the bounds
+            or collapsed to less than four positions.
+    """
+    west, south, east, north = bounds
+    for axis, value, keep_greater in [(0, west, True), (0, east, False), (1, south, True), (1, north, False)]:
+        if len(ring) == 0:
+            return None
+        ring = _clip_edge(ring, axis, value, keep_greater)
+    return close_ring(ring)
+
+
+def close_ring(ring):
+    """Closes the specified ring by repeating its first vertex, unless its last vertex already does.
+
+    Args:
+        ring (numpy.ndarray): An (n, 2) array of vertices.
+
+    Returns:
+        numpy.ndarray | None: The closed ring, or None if it has less than four positions once closed,
+            i.e. if it does not enclose an area.
+    """
+    if len(ring) and (ring[0] != ring[-1]).any():
+        ring = np.concatenate([ring, ring[:1]])
+    return ring if len(ring) >= 4 else None
+
+
+def _clip_edge(ring, axis, value, keep_greater):
+    """Clips the specified ring against a single axis-aligned edge.
+
+    Args:
+        ring (numpy.ndarray): An (n, 2) array of vertices.
+        axis (int): The axis the edge is perpendicular to, i.e. 0 for a vertical edge and 1 for a horizontal one.
+        value (float): The edge's coordinate on the axis.
+        keep_greater (bool): Whether the vertices on the greater side of the edge are kept.
+
+    Returns:
+        numpy.ndarray: The clipped ring.
+    """
+    current = ring
+    previous = np.roll(ring, 1, axis=0)
+    current_inside = current[:, axis] >= value if keep_greater else current[:, axis] <= value
+    previous_inside = np.roll(current_inside, 1)
+
+    # The intersection of the edge with the segment from the previous to the current vertex.
+    with np.errstate(invalid="ignore", divide="ignore"):
+        t = (value - previous[:, axis]) / (current[:, axis] - previous[:, axis])
+        intersection = previous + t[:, np.newaxis] * (current - previous)
+    intersection[:, axis] = value
+
+    # Each segment that crosses the edge contributes its intersection, followed by
+    # its current vertex if the latter is inside.
+    vertices = np.concatenate([intersection[:, np.newaxis], current[:, np.newaxis]], axis=1)
+    mask = np.column_stack([previous_inside != current_inside, current_inside])
+    return vertices[mask]
+
+
+class TileCache(object):
+    """A disk cache of gzip-compressed tiles.
+
+    Tiles are stored in <folder>/<category>/<version>/<z>/<x>/<y>.geojson.gz.
+    Each process keeps an index of the cached tiles in the order they were last
+    used, which is read from the folder once, when the cache is first used, and
+    is then kept up to date as tiles are read and written, so the folder is never
+    walked again. Tiles that another process writes are only accounted for once
+    they are read. Once the cache grows beyond its maximum size, the tiles of
+    outdated versions are evicted first, followed by the least recently used
+    tiles, until it is back to EVICTION_RATIO of its maximum size.
+    """
+    EVICTION_RATIO = 0.9
+    """The fraction of its maximum size that the cache is reduced to by an eviction."""
+
+    def __init__(self, folder, max_size):
+        """Creates a tile cache.
+
+        Args:
+            folder (str): The folder where tiles are stored.
+            max_size (int): The maximum size of the cache, in bytes.
+        """
+        self.folder = folder
+        self.max_size = max_size
+        self._index = None
+        self._size = 0
+        self._current_versions = {}
+        self._lock = Lock()
+
+    def get(self, category_name, version, z, x, y):
+        """Returns the specified tile.
+
+        Args:
+            category_name (str): The unique short name of the tile's category.
+            version (str): The version of the category's results.
+            z (int): The tile's zoom level.
+            x (int): The tile's column.
+            y (int): The tile's row.
+
+        Returns:
+            str | None: The gzip-compressed tile if it is cached, None otherwise.
+        """
+        filename = self._get_filename(category_name, version, z, x, y)
+        try:
+            with open(filename, "rb") as f:
+                tile = f.read()
+        except (IOError, OSError):
+            return None
+
+        with self._lock:
+            self._touch(filename, category_name, version, len(tile))
+        return tile
+
+    def put(self, category_name, version, z, x, y, tile):
+        """Stores the specified tile, then evicts tiles if the cache grew beyond its maximum size.
+
+        The tile is written to a temporary file which is then renamed, so that
+        a tile is never read while it is being written.
+
+        Args:
+            category_name (str): The unique short name of the tile's category.
+            version (str): The version of the category's results.
+            z (int): The tile's zoom level.
+            x (int): The tile's column.
+            y (int): The tile's row.
+            tile (str): The gzip-compressed tile.
+        """
+        import os
+        from tempfile import NamedTemporaryFile
+
+        filename = self._get_filename(category_name, version, z, x, y)
+        directory = os.path.dirname(filename)
+        try:
+            os.makedirs(directory)
+        except OSError:
+            if not os.path.isdir(directory):
+                raise
+
+        with NamedTemporaryFile(dir=directory, delete=False) as f:
+            f.write(tile)
+        os.rename(f.name, filename)
+
+        with self._lock:
+            self._current_versions[category_name] = version
+            self._touch(filename, category_name, version, len(tile))
+            if self._size > self.max_size:
+                self._evict()
+
+    def evict(self):
+        """Removes tiles until the cache is no larger than EVICTION_RATIO of its maximum size.
+        """
+        with self._lock:
+            self._load_index()
+            self._evict()
+
+    def _evict(self):
+        """Removes tiles until the cache is no larger than EVICTION_RATIO of its maximum size.
+
+        The caller must hold the cache's lock.
+        """
+        import os
+        from itertools import chain
+
+        outdated = [
+            filename for filename, (category_name, version, _) in self._index.iteritems()
+            if self._current_versions.get(category_name, version) != version
+        ]
+        for filename in chain(outdated, list(self._index)):
+            if self._size <= self.max_size * self.EVICTION_RATIO:
+                break
+
+            entry = self._index.pop(filename, None)
+            if entry is not None:
+                self._size -= entry[2]
+                try:
+                    os.remove(filename)
+                except OSError:
+                    pass
+
+    def _touch(self, filename, category_name, version, size):
+        """Marks the specified tile as the most recently used.
+
+        The caller must hold the cache's lock.
+        """
+        self._load_index()
+
+        entry = self._index.pop(filename, None)
+        if entry is not None:
+            self._size -= entry[2]
+        self._index[filename] = (category_name, version, size)
+        self._size += size
+
+    def _load_index(self):
+        """Reads the tiles that are stored in the cache's folder, unless they were already read.
+
+        The caller must hold the cache's lock.
+        """
+        import os
+
+        if self._index is not None:
+            return
+
+        tiles = []
+        for directory, _, filenames in os.walk(self.folder):
+            for filename in filenames:
+                filename = os.path.join(directory, filename)
+                try:
+                    status = os.stat(filename)
+                except OSError:
+                    continue
+
+                category_name, version = os.path.relpath(filename, self.folder).split(os.sep)[:2]
+                tiles.append((status.st_mtime, filename, category_name, version, status.st_size))
+
+        self._index = OrderedDict()
+        self._size = 0
+        for _, filename, category_name, version, size in sorted(tiles):
+            self._index[filename] = (category_name, version, size)
+            self._size += size
+
+    def _get_filename(self, category_name, version, z, x, y):
+        """Returns the name of the file that holds the specified tile.
+        """
+        import os
+        return os.path.join(self.folder, category_name, version, str(z), str(x), "{}.geojson.gz".format(y))
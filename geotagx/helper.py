@@ -25,9 +25,32 @@
 # DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
 # OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE
 # OR OTHER DEALINGS IN THE SOFTWARE.
+from collections import OrderedDict
+from threading import Lock
+
+_cover_images = OrderedDict()
+"""A per-process LRU cache of resolved cover image URLs, keyed by tuples that start with the image's container."""
+
+_cover_images_lock = Lock()
+
+COVER_IMAGE_FALLBACK_TTL = 10
+"""The maximum number of seconds an unblurred cover image URL is cached for, until its blurred version is ready."""
+
+CATEGORY_VERSION_KEY = "GEOTAGX-CATEGORY-VERSION"
+"""The key to the Redis string that holds the version of the project categories, which is incremented when they change."""
+
+_categories = {"version": None, "categories": {}}
+"""A per-process copy of every project category, keyed by identifier, and the version it was loaded at."""
+
+_categories_lock = Lock()
+
+
 def get_project_category(category_id):
     """Returns the project category instance with the specified identifier.
 
+    Categories are served from a per-process cache that is reloaded whenever
+    the categories' version changes, which is checked once per request.
+
     Args:
         category_id (int): A project category's unique identifier.
 
@@ -40,16 +63,108 @@ def get_project_category(category_id):
     if not isinstance(category_id, int):
         raise TypeError("get_project_category expects 'int' but got '{}'.".format(type(category_id).__name__))
 
+    category = _get_categories().get(category_id)
+    if category is None:
+        # The category may have been created after the cache was last loaded.
+        from pybossa.core import project_repo
+        category = project_repo.get_category(category_id)
+
+    return category
+
+
+def bump_category_version():
+    """Invalidates every process's cached project categories.
+    """
+    from pybossa.core import sentinel
+    sentinel.master.incr(CATEGORY_VERSION_KEY)
+
+
+def on_category_changed(mapper, connection, category):
+    """Marks the session that created, updated or deleted a project category.
+
+    This is a listener for the Category model's SQLAlchemy mapper events. The
+    categories' version is bumped once the session's changes are committed.
+    """
+    from sqlalchemy.orm import object_session
+
+    session = object_session(category)
+    if session is not None:
+        session.info["geotagx_categories_changed"] = True
+
+
+def on_session_committed(session):
+    """Bumps the categories' version if the committed session changed a project category.
+
+    This is a listener for the SQLAlchemy Session's after_commit event.
+    """
+    if session.info.pop("geotagx_categories_changed", False):
+        bump_category_version()
+
+
+def on_session_rolled_back(session):
+    """Discards the category changes of a session that was rolled back.
+
+    This is a listener for the SQLAlchemy Session's after_rollback event.
+    """
+    session.info.pop("geotagx_categories_changed", None)
+
+
+def _get_categories():
+    """Returns every project category.
+
+    Returns:
+        dict: A mapping of category identifiers to detached Category objects.
+    """
+    from flask import g
+    from pybossa.core import sentinel
+
+    version = getattr(g, "geotagx_category_version", None)
+    if version is None:
+        version = g.geotagx_category_version = sentinel.slave.get(CATEGORY_VERSION_KEY) or "0"
+
+    with _categories_lock:
+        if _categories["version"] == version:
+            return _categories["categories"]
+
+    categories = _load_categories()
+    with _categories_lock:
+        _categories["version"] = version
+        _categories["categories"] = categories
+
+    return categories
+
+
+def _load_categories():
+    """Loads every project category from the database.
+
+    The categories are copied into transient objects, so that they remain usable
+    outside of the session that loaded them.
+
+    Returns:
+        dict: A mapping of category identifiers to Category objects.
+    """
     from pybossa.core import project_repo
-    return project_repo.get_category(category_id)
+    from pybossa.model.category import Category
+
+    columns = [column.key for column in Category.__table__.columns]
+
+    categories = {}
+    for category in project_repo.get_all_categories():
+        categories[category.id] = Category(**{column: getattr(category, column) for column in columns})
+
+    return categories
 
 
 def get_blurred_cover_image_path(project):
     """Returns the URL to the blurred cover image for the project with the specified id.
 
-    If a project does not have a blurred cover image, a blur operation is performed
-    on its original cover image. If, however, the project does not have a cover
-    image, no operation is performed and empty string is returned instead.
+    If a project does not have a blurred cover image, its generation is scheduled
+    and the URL to the original cover image is returned until the blurred one is
+    ready. If, however, the project does not have a cover image, no operation is
+    performed and empty string is returned instead.
+
+    Resolved URLs are cached for GEOTAGX_COVER_IMAGE_CACHE_TTL seconds, so
+    that rendering a project card usually requires no filesystem access.
 
     Args:
         project (dict): A set of project attributes.
@@ -58,14 +173,15 @@ def get_blurred_cover_image_path(project):
         TypeError: If the 'project' argument is not a dictionary.
 
     Returns:
-        unicode: A URL to the blurred cover image or an empty string if no blurred image
-            was found or could be created.
+        unicode: A URL to the blurred or original cover image, or an empty string if
+            the project has no cover image.
     """
     if not isinstance(project, dict):
         raise TypeError("get_blurred_cover_image_path expects 'dict' but got '{}'.".format(type(project).__name__))
 
     from flask import current_app
-    from os.path import join, splitext, isfile
+    from os.path import join, isfile
+    from cover import get_blurred_path
 
 
     upload_folder = current_app.config["UPLOAD_FOLDER"]
@@ -76,28 +192,151 @@ def get_blurred_cover_image_path(project):
     if not container:
         return ""
 
+    key = (container, info["thumbnail"])
+    cached_path = _get_cached_cover_image(key)
+    if cached_path is not None:
+        return cached_path
+
     # A path in URL terms (does not include the upload folder).
     thumbnail_path = join(container, info["thumbnail"])
-    [filename, extension] = splitext(thumbnail_path)
-    blurred_thumbnail_path = filename + "_blurred" + extension
+    blurred_thumbnail_path = get_blurred_path(thumbnail_path)
 
     # The actual filename of both images.
     thumbnail_filename = join(upload_folder, thumbnail_path)
     blurred_thumbnail_filename = join(upload_folder, blurred_thumbnail_path)
 
-    # If the blurred image does not exist, try and generate a new one.
+    # If the blurred image does not exist, have a worker generate it and use the original in the meantime.
     if not isfile(blurred_thumbnail_filename):
         if isfile(thumbnail_filename):
-            from cv2 import imread, GaussianBlur, imwrite
-            thumbnail = imread(thumbnail_filename)
-            blurred_thumbnail = GaussianBlur(thumbnail, (7, 7), 0)
-            imwrite(blurred_thumbnail_filename, blurred_thumbnail)
-
-            # TODO Handle read/write errors!
-            # If there was an error writing the blurred cover image but the
-            # original exists, return the path to the original.
-            # blurred_thumbnail_path = thumbnail_path
+            from jobs import enqueue_blurred_cover_image
+            try:
+                enqueue_blurred_cover_image(thumbnail_filename, blurred_thumbnail_filename)
+            except Exception:
+                current_app.logger.exception("Could not schedule the blurring of '%s'.", thumbnail_filename)
+            blurred_thumbnail_path = thumbnail_path
         else:
             blurred_thumbnail_path = "" # The image could not be created since an original does not exist.
 
+    ttl = current_app.config["GEOTAGX_COVER_IMAGE_CACHE_TTL"]
+    if blurred_thumbnail_path == thumbnail_path or not blurred_thumbnail_path:
+        ttl = min(ttl, COVER_IMAGE_FALLBACK_TTL)
+    _cache_cover_image(key, blurred_thumbnail_path, ttl, current_app.config["GEOTAGX_COVER_IMAGE_CACHE_SIZE"])
+
     return blurred_thumbnail_path
+
+
+def get_cover_image_derivative_path(project, blurred=False, width=None, webp=False):
+    """Returns the URL to a derivative of the cover image for the specified project.
+
+    Derivatives are generated by the 'generate_cover_images' management command.
+    Until the requested derivative exists, the URL to the blurred cover image is
+    returned if a blurred derivative was requested, and the URL to the original
+    cover image otherwise. If the project does not have a cover image, an empty
+    string is returned instead. Resolved URLs are cached like those returned by
+    get_blurred_cover_image_path.
+
+    Args:
+        project (dict): A set of project attributes.
+        blurred (bool): If set to True, the URL to a blurred derivative is returned.
+        width (int): The derivative's width, one of cover.DERIVATIVE_WIDTHS, or None
+            if it has the original's size.
+        webp (bool): If set to True, the URL to a WebP variant is returned.
+
+    Raises:
+        TypeError: If the 'project' argument is not a dictionary.
+
+    Returns:
+        unicode: A URL to the derivative or its fallback, or an empty string if the
+            project has no cover image.
+    """
+    if not isinstance(project, dict):
+        raise TypeError("get_cover_image_derivative_path expects 'dict' but got '{}'.".format(type(project).__name__))
+
+    from flask import current_app
+    from os.path import join, isfile
+    from cover import get_derivative_path
+
+    info = project["info"]
+    container = info.get("container")
+    if not container:
+        return ""
+
+    key = (container, info["thumbnail"], blurred, width, webp)
+    cached_path = _get_cached_cover_image(key)
+    if cached_path is not None:
+        return cached_path
+
+    thumbnail_path = join(container, info["thumbnail"])
+    derivative_path = get_derivative_path(thumbnail_path, blurred, width, webp)
+
+    ttl = current_app.config["GEOTAGX_COVER_IMAGE_CACHE_TTL"]
+    if derivative_path != thumbnail_path and not isfile(join(current_app.config["UPLOAD_FOLDER"], derivative_path)):
+        derivative_path = get_blurred_cover_image_path(project) if blurred else thumbnail_path
+        ttl = min(ttl, COVER_IMAGE_FALLBACK_TTL)
+    _cache_cover_image(key, derivative_path, ttl, current_app.config["GEOTAGX_COVER_IMAGE_CACHE_SIZE"])
+
+    return derivative_path
+
+
+def invalidate_cover_image(container):
+    """Removes the cached cover image URLs of the projects whose images are stored in the specified container.
+
+    Args:
+        container (unicode): A container in the upload folder.
+    """
+    with _cover_images_lock:
+        for key in [key for key in _cover_images if key[0] == container]:
+            del _cover_images[key]
+
+
+def on_project_changed(mapper, connection, project):
+    """Invalidates the cached cover image URLs of a project that was updated or deleted.
+
+    This is a listener for the Project model's SQLAlchemy mapper events. Both the
+    project's current and previous containers are invalidated.
+    """
+    from sqlalchemy.orm.attributes import get_history
+
+    history = get_history(project, "info")
+    for info in [project.info] + list(history.deleted or []):
+        container = (info or {}).get("container")
+        if container:
+            invalidate_cover_image(container)
+
+
+def _get_cached_cover_image(key):
+    """Returns the cached cover image URL with the specified key.
+
+    Args:
+        key (tuple): The cover image URL's key, which starts with the image's container.
+
+    Returns:
+        unicode | None: The cover image URL, or None if it is not cached or has expired.
+    """
+    from time import time
+
+    with _cover_images_lock:
+        entry = _cover_images.pop(key, None)
+        if entry is None or entry[1] < time():
+            return None
+
+        _cover_images[key] = entry
+        return entry[0]
+
+
+def _cache_cover_image(key, path, ttl, max_size):
+    """Caches a cover image URL.
+
+    Args:
+        key (tuple): The cover image URL's key, which starts with the image's container.
+        path (unicode): The cover image URL.
+        ttl (int): The number of seconds the URL is cached for.
+        max_size (int): The maximum number of cached URLs. The least recently used are evicted first.
+    """
+    from time import time
+
+    with _cover_images_lock:
+        _cover_images.pop(key, None)
+        _cover_images[key] = (path, time() + ttl)
+        while len(_cover_images) > max_size:
+            _cover_images.popitem(last=False)
@@ -0,0 +1,489 @@
+# -*- coding: utf-8 -*-
+#
+# This module is part of the GeoTag-X PyBossa plugin.
+# It contains the plugin's background jobs.
+#
+# Copyright (c) 2017 UNITAR/UNOSAT
+#
+# The MIT License (MIT)
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE
+# OR OTHER DEALINGS IN THE SOFTWARE.
+#
+# The jobs are run by PyBossa's RQ workers, which provide the application context.
+import re
+
+NEWSLETTER_JOB_KEY = "GEOTAGX-NEWSLETTER-JOB:{}"
+"""The key to the Redis hash that holds a newsletter job's progress."""
+
+NEWSLETTER_FAILURES_KEY = "GEOTAGX-NEWSLETTER-JOB-FAILURES:{}"
+"""The key to the Redis hash that maps the recipients a newsletter job failed to reach to the error."""
+
+NEWSLETTER_JOB_TTL = 7 * 24 * 60 * 60
+"""The number of seconds a newsletter job's progress is kept for."""
+
+NEWSLETTER_JOB_TIMEOUT = 24 * 60 * 60
+"""The maximum number of seconds a newsletter job may run for."""
+
+FLUSH_JOB_KEY = "GEOTAGX-FLUSH-TASK-RUNS-JOB:{}"
+"""The key to the Redis hash that holds the progress of a project's task run flush."""
+
+FLUSH_JOB_TTL = 24 * 60 * 60
+"""The number of seconds a task run flush's progress is kept for."""
+
+FLUSH_JOB_TIMEOUT = 6 * 60 * 60
+"""The maximum number of seconds a task run flush may run for."""
+
+FLUSH_BATCH_SIZE = 10000
+"""The number of task runs deleted by each statement of a background flush."""
+
+GEOJSON_SUMMARIES_JOB_KEY = "GEOTAGX-GEOJSON-SUMMARIES-JOB:{}"
+"""The key to the Redis string that marks a project's GeoJSON summaries as being updated."""
+
+GEOJSON_SUMMARIES_JOB_TTL = 10 * 60
+"""The number of seconds after which an update of a project's GeoJSON summaries that is still not complete may be scheduled again."""
+
+GEOJSON_SUMMARIES_JOB_TIMEOUT = 6 * 60 * 60
+"""The maximum number of seconds an update of a project's GeoJSON summaries may run for."""
+
+BLUR_JOB_KEY = "GEOTAGX-BLUR-JOB:{}"
+"""The key to the Redis string that marks a blurred cover image as being generated, or as having failed to be."""
+
+BLUR_JOB_TTL = 10 * 60
+"""The number of seconds after which a blurred cover image that is still not generated may be scheduled again."""
+
+BLUR_FAILURE_TTL = 24 * 60 * 60
+"""The number of seconds after which a blurred cover image that could not be generated may be scheduled again."""
+
+EMAIL_REGEX = re.compile(r"([^@|\s]+@[^@]+\.[^@|\s]+)")
+
+
+def enqueue_newsletter(subject, html, recipients=None):
+    """Schedules the delivery of a newsletter.
+
+    Args:
+        subject (unicode): The newsletter's subject.
+        html (unicode): The newsletter's HTML body.
+        recipients (list): The newsletter's recipients. If unspecified, the
+            newsletter is sent to every subscribed user.
+
+    Returns:
+        str: The newsletter job's identifier.
+    """
+    from pybossa.core import sentinel
+    from rq import Queue
+    from uuid import uuid4
+    from time import time
+
+    job_id = uuid4().hex
+    key = NEWSLETTER_JOB_KEY.format(job_id)
+
+    pipeline = sentinel.master.pipeline()
+    pipeline.hmset(key, {"status": "queued", "subject": subject, "total": 0, "sent": 0, "failed": 0, "created": int(time())})
+    pipeline.expire(key, NEWSLETTER_JOB_TTL)
+    pipeline.execute()
+
+    queue = Queue("email", connection=sentinel.master)
+    queue.enqueue(send_newsletter, job_id, subject, html, recipients, timeout=NEWSLETTER_JOB_TIMEOUT)
+
+    return job_id
+
+
+def send_newsletter(job_id, subject, html, recipients=None):
+    """Sends a newsletter to each of the specified recipients.
+
+    The mails are sent in batches, each of which reuses a single SMTP connection.
+    The job's progress is saved after each batch, and the recipients that could
+    not be reached are recorded along with the error. If the job fails, its
+    status is set to "failed" before the error is raised again.
+
+    Args:
+        job_id (str): The newsletter job's identifier.
+        subject (unicode): The newsletter's subject.
+        html (unicode): The newsletter's HTML body.
+        recipients (list): The newsletter's recipients. If unspecified, the
+            newsletter is sent to every subscribed user.
+    """
+    from flask import current_app
+    from flask.ext.mail import Message
+    from pybossa.core import mail, sentinel
+
+    key = NEWSLETTER_JOB_KEY.format(job_id)
+    failures_key = NEWSLETTER_FAILURES_KEY.format(job_id)
+
+    try:
+        if recipients is None:
+            recipients = _get_subscribers()
+
+        sentinel.master.hmset(key, {"status": "running", "total": len(recipients)})
+
+        batch_size = max(1, current_app.config["GEOTAGX_NEWSLETTER_BATCH_SIZE"])
+        for start in xrange(0, len(recipients), batch_size):
+            batch = recipients[start:start + batch_size]
+            failures = {}
+            try:
+                with mail.connect() as connection:
+                    for recipient in batch:
+                        try:
+                            connection.send(Message(subject=subject, html=html, recipients=[recipient]))
+                        except Exception as e:
+                            failures[recipient] = repr(e)
+            except Exception as e:
+                # The connection could not be opened or closed: the batch's outcome is unknown.
+                for recipient in batch:
+                    failures.setdefault(recipient, repr(e))
+
+            pipeline = sentinel.master.pipeline()
+            pipeline.hincrby(key, "sent", len(batch) - len(failures))
+            pipeline.hincrby(key, "failed", len(failures))
+            if failures:
+                pipeline.hmset(failures_key, failures)
+                pipeline.expire(failures_key, NEWSLETTER_JOB_TTL)
+            pipeline.execute()
+    except Exception:
+        _set_job_status(key, "failed", NEWSLETTER_JOB_TTL)
+        raise
+
+    _set_job_status(key, "finished", NEWSLETTER_JOB_TTL)
+
+
+def get_newsletter_status(job_id):
+    """Returns the specified newsletter job's progress.
+
+    Args:
+        job_id (str): The newsletter job's identifier.
+
+    Returns:
+        dict | None: The job's status, its number of recipients, sent and failed mails,
+            and a mapping of the recipients that could not be reached to the error,
+            or None if the job does not exist.
+    """
+    from pybossa.core import sentinel
+
+    pipeline = sentinel.master.pipeline()
+    pipeline.hgetall(NEWSLETTER_JOB_KEY.format(job_id))
+    pipeline.hgetall(NEWSLETTER_FAILURES_KEY.format(job_id))
+    progress, failures = pipeline.execute()
+    if not progress:
+        return None
+
+    status = {
+        "status": progress["status"],
+        "subject": progress["subject"].decode("utf-8"),
+        "created": int(progress["created"]),
+        "failures": failures,
+    }
+    for field in ("total", "sent", "failed"):
+        status[field] = int(progress.get(field, 0))
+
+    return status
+
+
+def enqueue_flush_task_runs(project_id):
+    """Schedules the deletion of every task run of the specified project.
+
+    Args:
+        project_id (int): The project's identifier.
+
+    Returns:
+        bool: True if the flush was scheduled, False if one is already pending.
+    """
+    from pybossa.core import sentinel
+    from rq import Queue
+
+    key = FLUSH_JOB_KEY.format(project_id)
+    if sentinel.master.hget(key, "status") in ("queued", "running"):
+        return False
+
+    pipeline = sentinel.master.pipeline()
+    pipeline.delete(key)
+    pipeline.hmset(key, {"status": "queued", "total": 0, "deleted": 0})
+    pipeline.expire(key, FLUSH_JOB_TTL)
+    pipeline.execute()
+
+    queue = Queue("medium", connection=sentinel.master)
+    queue.enqueue(flush_task_runs, project_id, timeout=FLUSH_JOB_TIMEOUT)
+
+    return True
+
+
+def flush_task_runs(project_id, batch_size=FLUSH_BATCH_SIZE):
+    """Deletes every task run of the specified project, and marks its tasks as ongoing.
+
+    The task runs are deleted by set-based statements of up to batch_size rows,
+    after each of which the flush's progress is saved. The project's cached data
+    is cleaned once the flush is complete. If the flush fails, its status is set
+    to "failed" before the error is raised again.
+
+    Args:
+        project_id (int): The project's identifier.
+        batch_size (int): The number of task runs deleted by each statement, or
+            None to delete them all with a single statement.
+    """
+    from pybossa.core import sentinel
+
+    key = FLUSH_JOB_KEY.format(project_id)
+    try:
+        pipeline = sentinel.master.pipeline()
+        pipeline.hmset(key, {"status": "running", "total": _count_task_runs(project_id)})
+        pipeline.expire(key, FLUSH_JOB_TTL)
+        pipeline.execute()
+
+        for deleted in _delete_task_runs(project_id, batch_size):
+            pipeline = sentinel.master.pipeline()
+            pipeline.hincrby(key, "deleted", deleted)
+            pipeline.expire(key, FLUSH_JOB_TTL)
+            pipeline.execute()
+
+        _clean_flushed_project(project_id)
+    except Exception:
+        _set_job_status(key, "failed", FLUSH_JOB_TTL)
+        raise
+
+    _set_job_status(key, "finished", FLUSH_JOB_TTL)
+
+
+def flush_task_runs_now(project_id):
+    """Deletes every task run of the specified project with a single statement, and marks its tasks as ongoing.
+
+    Unlike flush_task_runs, the flush's progress is not saved, as the flush is
+    meant to be complete by the time the caller, e.g. a request, returns.
+
+    Args:
+        project_id (int): The project's identifier.
+    """
+    for _ in _delete_task_runs(project_id):
+        pass
+
+    _clean_flushed_project(project_id)
+
+
+def get_flush_task_runs_status(project_id):
+    """Returns the progress of the specified project's task run flush.
+
+    Args:
+        project_id (int): The project's identifier.
+
+    Returns:
+        dict | None: The flush's status, and its total and deleted number of task runs,
+            or None if the project's task runs were not flushed recently.
+    """
+    from pybossa.core import sentinel
+
+    progress = sentinel.master.hgetall(FLUSH_JOB_KEY.format(project_id))
+    if not progress:
+        return None
+
+    return {
+        "status": progress["status"],
+        "total": int(progress.get("total", 0)),
+        "deleted": int(progress.get("deleted", 0)),
+    }
+
+
+def enqueue_geojson_summaries_update(project_id, rebuild=False):
+    """Schedules an update of the specified project's GeoJSON summaries, unless one is already scheduled.
+
+    Args:
+        project_id (int): The project's identifier.
+        rebuild (bool): If set to True, the summaries are rebuilt from every task run.
+
+    Returns:
+        bool: True if the update was scheduled, False if one is already in progress.
+    """
+    from pybossa.core import sentinel
+    from rq import Queue
+
+    if not sentinel.master.set(GEOJSON_SUMMARIES_JOB_KEY.format(project_id), 1, nx=True, ex=GEOJSON_SUMMARIES_JOB_TTL):
+        return False
+
+    queue = Queue("medium", connection=sentinel.master)
+    queue.enqueue(update_geojson_summaries, project_id, rebuild, timeout=GEOJSON_SUMMARIES_JOB_TIMEOUT)
+
+    return True
+
+
+def update_geojson_summaries(project_id, rebuild=False):
+    """Updates the specified project's GeoJSON summaries.
+
+    Args:
+        project_id (int): The project's identifier.
+        rebuild (bool): If set to True, the summaries are rebuilt from every task run.
+    """
+    from pybossa.core import sentinel
+    from geo import store
+
+    try:
+        if rebuild:
+            store.rebuild(project_id)
+        else:
+            store.update(project_id)
+    finally:
+        sentinel.master.delete(GEOJSON_SUMMARIES_JOB_KEY.format(project_id))
+
+
+def enqueue_blurred_cover_image(thumbnail_filename, blurred_filename):
+    """Schedules the generation of a blurred cover image, unless it is already scheduled.
+
+    Args:
+        thumbnail_filename (str): The filename of the original cover image.
+        blurred_filename (str): The filename of the blurred cover image.
+
+    Returns:
+        bool: True if the generation was scheduled, False if it is already in progress or recently failed.
+    """
+    from pybossa.core import sentinel
+    from rq import Queue
+
+    if not sentinel.master.set(BLUR_JOB_KEY.format(blurred_filename), 1, nx=True, ex=BLUR_JOB_TTL):
+        return False
+
+    queue = Queue("low", connection=sentinel.master)
+    queue.enqueue(generate_blurred_cover_image, thumbnail_filename, blurred_filename)
+
+    return True
+
+
+def generate_blurred_cover_image(thumbnail_filename, blurred_filename):
+    """Generates a blurred cover image.
+
+    If the cover image cannot be blurred, e.g. because it cannot be decoded, its
+    marker is kept for BLUR_FAILURE_TTL seconds, so that the failing job is not
+    scheduled again each time the original cover image is displayed instead.
+
+    Args:
+        thumbnail_filename (str): The filename of the original cover image.
+        blurred_filename (str): The filename of the blurred cover image.
+    """
+    from pybossa.core import sentinel
+    import cover
+
+    key = BLUR_JOB_KEY.format(blurred_filename)
+    try:
+        cover.blur(thumbnail_filename, blurred_filename)
+    except Exception:
+        sentinel.master.set(key, "failed", ex=BLUR_FAILURE_TTL)
+        raise
+
+    sentinel.master.delete(key)
+
+
+def _set_job_status(key, status, ttl):
+    """Sets the status of the job whose progress is held by the specified Redis hash.
+
+    Args:
+        key (str): The key to the job's Redis hash.
+        status (str): The job's status.
+        ttl (int): The number of seconds the job's progress is kept for, from now on.
+    """
+    from pybossa.core import sentinel
+
+    pipeline = sentinel.master.pipeline()
+    pipeline.hset(key, "status", status)
+    pipeline.expire(key, ttl)
+    pipeline.execute()
+
+
+def _clean_flushed_project(project_id):
+    """Marks the tasks of the specified project as ongoing once its task runs were flushed, and cleans its cached data.
+
+    Args:
+        project_id (int): The project's identifier.
+    """
+    from pybossa.cache import projects as cached_projects
+    from geo import store as geojson_summaries
+
+    _reset_tasks(project_id)
+
+    cached_projects.clean_project(project_id)
+    geojson_summaries.reset(project_id)
+
+
+def _count_task_runs(project_id):
+    """Returns the specified project's number of task runs.
+
+    Args:
+        project_id (int): The project's identifier.
+
+    Returns:
+        int: The number of task runs.
+    """
+    from pybossa.core import db
+    from pybossa.model.task_run import TaskRun
+    from sqlalchemy import func
+
+    return db.session.query(func.count(TaskRun.id)).filter(TaskRun.project_id == project_id).scalar()
+
+
+def _delete_task_runs(project_id, batch_size=None):
+    """Deletes every task run of the specified project.
+
+    Each batch of task runs is deleted by a single statement and committed.
+
+    Args:
+        project_id (int): The project's identifier.
+        batch_size (int): The maximum number of task runs per batch, or None to
+            delete them all at once.
+
+    Yields:
+        int: The number of task runs deleted by each batch.
+    """
+    from pybossa.core import db
+    from pybossa.model.task_run import TaskRun
+
+    while True:
+        query = TaskRun.query.filter(TaskRun.project_id == project_id)
+        if batch_size:
+            batch = db.session.query(TaskRun.id)\
+                              .filter(TaskRun.project_id == project_id)\
+                              .order_by(TaskRun.id)\
+                              .limit(batch_size)\
+                              .subquery()
+            query = TaskRun.query.filter(TaskRun.id.in_(batch))
+
+        deleted = query.delete(synchronize_session=False)
+        db.session.commit()
+        if deleted:
+            yield deleted
+        if not batch_size or deleted < batch_size:
+            break
+
+
+def _reset_tasks(project_id):
+    """Marks every task of the specified project as ongoing, with a single statement.
+
+    Args:
+        project_id (int): The project's identifier.
+    """
+    from pybossa.core import db
+    from pybossa.model.task import Task
+
+    Task.query.filter(Task.project_id == project_id, Task.state != u"ongoing")\
+              .update({Task.state: u"ongoing"}, synchronize_session=False)
+    db.session.commit()
+
+
+def _get_subscribers():
+    """Returns the email addresses of the users that are subscribed to the newsletter.
+
+    Returns:
+        list: A list of valid email addresses.
+    """
+    from pybossa.model.user import User
+
+    query = User.query.with_entities(User.email_addr).filter(User.subscribed == True)
+    return [email for (email,) in query if email and EMAIL_REGEX.match(email)]
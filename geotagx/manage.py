@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+#
+# This module is part of the GeoTag-X PyBossa plugin.
+# It contains the plugin's management commands.
+#
+# Copyright (c) 2017 UNITAR/UNOSAT
+#
+# The MIT License (MIT)
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE
+# OR OTHER DEALINGS IN THE SOFTWARE.
+#
+# The commands are grouped in a Flask-Script manager that can be added to
+# PyBossa's own, e.g. manager.add_command("geotagx", geotagx.manage.manager).
+from flask.ext.script import Manager
+
+manager = Manager(usage="Performs GeoTag-X maintenance operations.")
+
+
+@manager.option("-c", "--category", dest="category_short_name", default=None,
+                help="Only rebuild the summaries of the projects in the category with the specified short name.")
+def rebuild_geojson_summaries(category_short_name=None):
+    """Rebuilds the GeoJSON exporter's summaries from every task run.
+    """
+    from pybossa.model.project import Project
+    from pybossa.model.category import Category
+    from geo import store
+
+    query = Project.query
+    if category_short_name:
+        query = query.join(Category).filter(Category.short_name == category_short_name)
+
+    for (project_id, short_name) in query.with_entities(Project.id, Project.short_name).order_by(Project.id):
+        print "Rebuilding the GeoJSON summaries of '{}'...".format(short_name)
+        store.rebuild(project_id)
+
+
+@manager.option("-p", "--processes", dest="processes", type=int, default=None,
+                help="The number of worker processes. Defaults to the number of CPUs.")
+@manager.option("-f", "--force", dest="force", action="store_true", default=False,
+                help="Regenerate every derivative, including those that are up to date.")
+def generate_cover_images(processes=None, force=False):
+    """Generates the missing or stale derivatives of every project's cover image.
+    """
+    from flask import current_app
+    from multiprocessing import Pool
+    from os.path import join, isfile
+    from pybossa.model.project import Project
+
+    upload_folder = current_app.config["UPLOAD_FOLDER"]
+
+    thumbnail_filenames = set()
+    for (info,) in Project.query.with_entities(Project.info):
+        container = (info or {}).get("container")
+        thumbnail = (info or {}).get("thumbnail")
+        if container and thumbnail:
+            thumbnail_filename = join(upload_folder, container, thumbnail)
+            if isfile(thumbnail_filename):
+                thumbnail_filenames.add(thumbnail_filename)
+
+    print "Generating the derivatives of {} cover images...".format(len(thumbnail_filenames))
+    pool = Pool(processes)
+    try:
+        n_derivatives = 0
+        arguments = [(f, force) for f in sorted(thumbnail_filenames)]
+        for (thumbnail_filename, n, error) in pool.imap_unordered(_generate_cover_image_derivatives, arguments):
+            if error:
+                print "Could not generate the derivatives of '{}': {}".format(thumbnail_filename, error)
+            n_derivatives += n
+    finally:
+        pool.close()
+        pool.join()
+
+    print "Generated {} derivatives.".format(n_derivatives)
+
+
+def _generate_cover_image_derivatives(arguments):
+    """Generates a cover image's derivatives in a worker process.
+
+    Args:
+        arguments (tuple): The cover image's filename, and whether up-to-date derivatives are regenerated.
+
+    Returns:
+        tuple: The cover image's filename, its number of generated derivatives, and
+            the error that occurred if any.
+    """
+    from cover import generate_derivatives
+
+    (thumbnail_filename, force) = arguments
+    try:
+        return (thumbnail_filename, generate_derivatives(thumbnail_filename, force), None)
+    except Exception as e:
+        return (thumbnail_filename, 0, str(e))
+
+
+@manager.option("-H", "--host", dest="host", default="localhost", help="The address the SMTP sink listens on.")
+@manager.option("-p", "--port", dest="port", type=int, default=1025, help="The port the SMTP sink listens on.")
+def smtp_sink(host="localhost", port=1025):
+    """Runs a local SMTP server that logs and discards every mail it receives.
+
+    Pointing MAIL_SERVER and MAIL_PORT at the sink allows the newsletter's delivery
+    to be tested without reaching real recipients.
+    """
+    import asyncore
+    import smtpd
+
+    class SMTPSink(smtpd.SMTPServer):
+        def process_message(self, peer, mailfrom, rcpttos, data):
+            print "Received a {}-byte mail from {} to {}.".format(len(data), mailfrom, ", ".join(rcpttos))
+
+    SMTPSink((host, port), None)
+    print "Listening on {}:{}...".format(host, port)
+    try:
+        asyncore.loop()
+    except KeyboardInterrupt:
+        pass
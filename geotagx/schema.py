@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+#
+# This module is part of the GeoTag-X PyBossa plugin.
+# It contains the registry of the supported GeoTag-X projects' schemas.
+#
+# Copyright (c) 2017 UNITAR/UNOSAT
+#
+# The MIT License (MIT)
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE
+# OR OTHER DEALINGS IN THE SOFTWARE.
+#
+# The schemas are read from the GEOTAGX_SUPPORTED_PROJECTS_SCHEMA configuration
+# entry, a dictionary of project schemas created with the geotagx-project-template
+# indexed by project short name. The registry compiles them once so that lookups
+# do not allocate, and recompiles them whenever the configuration entry is replaced.
+from collections import namedtuple
+from flask import current_app
+
+Question = namedtuple("Question", ["key", "namespaced_key", "type", "title"])
+"""A question in a project's schema.
+
+Attributes:
+    key (unicode): The key under which the question's answer is saved in a task run.
+    namespaced_key (unicode): The key prefixed with the project's short name, i.e. "<short_name>::<key>".
+    type (unicode): The question's type, e.g. "geotagging".
+    title (unicode): The question's text.
+"""
+
+
+class ProjectSchema(object):
+    """A project's compiled schema.
+
+    Attributes:
+        short_name (unicode): The project's short name.
+        questions (tuple): The project's questions, in the order they appear in the schema.
+        total_key (unicode): The key under which the project's number of task runs is exported.
+        raw (dict): The project's schema, as it appears in the configuration.
+    """
+    __slots__ = ["short_name", "questions", "total_key", "raw"]
+
+    def __init__(self, short_name, schema):
+        self.short_name = short_name
+        self.raw = schema
+        self.total_key = short_name + u"::GEOTAGX_TOTAL"
+        self.questions = tuple(
+            Question(
+                key=question["answer"]["saved_as"],
+                namespaced_key=short_name + u"::" + question["answer"]["saved_as"],
+                type=question["type"],
+                title=question["title"],
+            )
+            for question in schema["questions"]
+        )
+
+
+class SchemaRegistry(object):
+    """The registry of the supported projects' compiled schemas.
+    """
+    def __init__(self):
+        self._source = None
+        self._schemas = {}
+        self._fingerprint = None
+
+    def build(self, source):
+        """Compiles the specified project schemas.
+
+        Args:
+            source (dict): A dictionary of project schemas, indexed by project short name.
+        """
+        import hashlib
+        import json
+
+        self._schemas = {short_name: ProjectSchema(short_name, schema) for short_name, schema in (source or {}).iteritems()}
+        self._fingerprint = hashlib.md5(json.dumps(source, sort_keys=True)).hexdigest()
+        self._source = source
+
+    def get(self, short_name):
+        """Returns the compiled schema of the project with the specified short name.
+
+        Args:
+            short_name (unicode): A project's short name.
+
+        Returns:
+            ProjectSchema | None: The project's schema if it is supported, None otherwise.
+        """
+        return self._get_schemas().get(short_name)
+
+    def get_fingerprint(self):
+        """Returns a digest of the project schemas that changes whenever one of them does.
+
+        Returns:
+            str: A hexadecimal digest of the project schemas.
+        """
+        self._get_schemas()
+        return self._fingerprint
+
+    def _get_schemas(self):
+        """Returns the compiled schemas, recompiling them if the configuration entry was replaced.
+        """
+        source = current_app.config.get("GEOTAGX_SUPPORTED_PROJECTS_SCHEMA")
+        if source is not self._source:
+            self.build(source)
+        return self._schemas
+
+
+registry = SchemaRegistry()
+"""The supported projects' schema registry."""
@@ -27,22 +27,25 @@
 # OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE
 # OR OTHER DEALINGS IN THE SOFTWARE.
 from flask import Blueprint, render_template, request, redirect, url_for, abort, flash
-from flask import current_app, jsonify, Response
+from flask import current_app, jsonify, Response, stream_with_context
 from flask.ext.login import login_required, current_user
-from flask.ext.mail import Message
-from pybossa.core import db, user_repo, mail
+from pybossa.core import db
 from pybossa.cache import users as cached_users
 from pybossa.model.project import Project
 from pybossa.model.task_run import TaskRun
 from pybossa.model.user import User
 from pybossa.util import Pagination, pretty_date, admin_required, UnicodeWriter
+from sqlalchemy import func
 from StringIO import StringIO
-import re
+from itertools import islice
 import json
 import markdown
 
 blueprint = Blueprint("geotagx-admin", __name__)
 
+EXPORT_CHUNK_SIZE = 500
+"""The number of users that are read from the database and written to an export at a time."""
+
 
 @blueprint.route("/send-newsletter", methods=["GET", "POST"])
 @login_required
@@ -52,38 +55,48 @@ def send_newsletter():
         Endpoint to send newsletter to all subscribersIL
     """
     from ..model.form.newsletter import NewsletterForm
+    from ..jobs import enqueue_newsletter
 
     form = NewsletterForm()
+    job_id = None
     if request.method == "POST":
         try:
             if request.form.get('debug_mode'):
                 SUBJECT = "DEBUG :: "+request.form['subject']
                 EMAIL_LIST = current_app.config['GEOTAGX_NEWSLETTER_DEBUG_EMAIL_LIST']
             else:
-                EMAIL_REGEX = "([^@|\s]+@[^@]+\.[^@|\s]+)"
                 SUBJECT = request.form['subject']
-                user_list = User.query.with_entities(User.email_addr).filter(User.subscribed==True).all()
-                EMAIL_LIST = []
-
-                for _user_email in user_list:
-                    if re.match(EMAIL_REGEX, _user_email[0]):
-                        EMAIL_LIST.append(_user_email[0])
-
-            mail_dict = dict(
-                    subject=SUBJECT,
-                    html=markdown.markdown(request.form['message']),
-                    # recipients=['geotagx@cern.ch'],#The "To" field of the email always points to the geotagx e-group. Also helps in archiving.
-                )
-            for _email in EMAIL_LIST:
-                mail_dict['recipients'] = [_email]
-                message = Message(**mail_dict)
-                mail.send(message)
-            flash("Newsletter sent successfully", "success")
-        except:
+                # The job sends the newsletter to every subscriber.
+                EMAIL_LIST = None
+
+            job_id = enqueue_newsletter(SUBJECT, markdown.markdown(request.form['message']), EMAIL_LIST)
+            flash("The newsletter is being sent. Its progress is available at <a href=\"{0}\">{0}</a>."
+                  .format(url_for('.newsletter_status', job_id=job_id)), "success")
+        except Exception:
+            current_app.logger.exception("Unable to schedule the newsletter.")
             flash("Unable to send newsletter. Please contact the systems administrator.", "error")
 
     debug_emails = current_app.config["GEOTAGX_NEWSLETTER_DEBUG_EMAIL_LIST"]
-    return render_template("/geotagx/newsletter/newsletter.html", form=form, debug_emails=debug_emails)
+    return render_template("/geotagx/newsletter/newsletter.html", form=form, debug_emails=debug_emails, job_id=job_id)
+
+
+@blueprint.route("/send-newsletter/<job_id>")
+@login_required
+@admin_required
+def newsletter_status(job_id):
+    """Returns a newsletter job's progress as JSON.
+
+    The response contains the job's status ("queued", "running", "finished" or "failed"),
+    its number of recipients, the number of sent and failed mails, and a mapping
+    of the recipients that could not be reached to the error.
+    """
+    from ..jobs import get_newsletter_status
+
+    status = get_newsletter_status(job_id)
+    if status is None:
+        abort(404)
+
+    return jsonify(status)
 
 
 @blueprint.route("/manage-users/", defaults={"page": 1})
@@ -107,8 +120,15 @@ def manage_users(page):
     """
     Normalize accounts for it to be rendered by the global helper functions we use in the theme
     """
+    task_run_counts = {}
+    if accounts:
+        counts = db.session.query(TaskRun.user_id, func.count(TaskRun.id))\
+                           .filter(TaskRun.user_id.in_([k.id for k in accounts]))\
+                           .group_by(TaskRun.user_id)
+        task_run_counts = dict(counts)
+
     for k in accounts:
-        k.n_task_runs = len(k.task_runs)
+        k.n_task_runs = task_run_counts.get(k.id, 0)
         k.registered_ago = pretty_date(k.created)
 
     if not accounts and page !=1 and not current_user.admin:
@@ -133,24 +153,27 @@ def export_users():
 
     def respond_json():
         tmp = 'attachment; filename=all_users.json'
-        res = Response(gen_json(), mimetype='application/json')
+        res = Response(stream_with_context(gen_json()), mimetype='application/json')
         res.headers['Content-Disposition'] = tmp
         return res
 
     def gen_json():
-        users = user_repo.get_all()
-        json_users = []
-        for user in users:
-          json_datum = dictize_with_exportable_attributes(user)
-          if 'geotagx_survey_status' in user.info.keys():
-            json_datum['geotagx_survey_status'] = user.info['geotagx_survey_status']
-          else:
-            json_datum['geotagx_survey_status'] = "RESPONSE_NOT_TAKEN"
-
-          # Append total task_runs to json export data
-          json_datum['task_runs'] = len(TaskRun.query.filter(TaskRun.user_id == user.id).all())
-          json_users.append(json_datum)
-        return json.dumps(json_users)
+        separator = '['
+        for chunk in iter_users():
+            json_users = []
+            for user, n_task_runs in chunk:
+              json_datum = dictize_with_exportable_attributes(user)
+              if 'geotagx_survey_status' in user.info.keys():
+                json_datum['geotagx_survey_status'] = user.info['geotagx_survey_status']
+              else:
+                json_datum['geotagx_survey_status'] = "RESPONSE_NOT_TAKEN"
+
+              # Append total task_runs to json export data
+              json_datum['task_runs'] = n_task_runs
+              json_users.append(json.dumps(json_datum))
+            yield separator + ','.join(json_users)
+            separator = ','
+        yield '[]' if separator == '[' else ']'
 
     def dictize_with_exportable_attributes(user):
         dict_user = {}
@@ -158,21 +181,50 @@ def export_users():
             dict_user[attr] = getattr(user, attr)
         return dict_user
 
+    def iter_users():
+        """Yields chunks of (user, number of task runs) pairs.
+
+        The users and their task run counts are fetched in one query, and read
+        through a server-side cursor so that only a chunk of users is held in
+        memory at a time.
+        """
+        counts = db.session.query(TaskRun.user_id, func.count(TaskRun.id).label('n_task_runs'))\
+                           .filter(TaskRun.user_id != None)\
+                           .group_by(TaskRun.user_id)\
+                           .subquery()
+        query = db.session.query(User, func.coalesce(counts.c.n_task_runs, 0))\
+                          .outerjoin(counts, counts.c.user_id == User.id)\
+                          .order_by(User.id)\
+                          .yield_per(EXPORT_CHUNK_SIZE)
+        rows = iter(query)
+        while True:
+            chunk = list(islice(rows, EXPORT_CHUNK_SIZE))
+            if not chunk:
+                break
+            yield chunk
+            # The exported users are no longer needed by the session.
+            for user, _ in chunk:
+                db.session.expunge(user)
+
     def respond_csv():
         out = StringIO()
         writer = UnicodeWriter(out)
         tmp = 'attachment; filename=all_users.csv'
-        res = Response(gen_csv(out, writer, write_user), mimetype='text/csv')
+        res = Response(stream_with_context(gen_csv(out, writer, write_user)), mimetype='text/csv')
         res.headers['Content-Disposition'] = tmp
         return res
 
     def gen_csv(out, writer, write_user):
         add_headers(writer)
-        for user in user_repo.get_all():
-            write_user(writer, user)
+        for chunk in iter_users():
+            for user, n_task_runs in chunk:
+                write_user(writer, user, n_task_runs)
+            yield out.getvalue()
+            out.seek(0)
+            out.truncate()
         yield out.getvalue()
 
-    def write_user(writer, user):
+    def write_user(writer, user, n_task_runs):
         values = [getattr(user, attr) for attr in sorted(exportable_attributes)]
         if 'geotagx_survey_status' in user.info.keys():
           values.append(user.info['geotagx_survey_status'])
@@ -180,7 +232,7 @@ def export_users():
           values.append('RESPONSE_NOT_TAKEN')
 
         # Add total task_runs by the user
-        values.append(len(TaskRun.query.filter(TaskRun.user_id == user.id).all()))
+        values.append(n_task_runs)
         writer.writerow(values)
 
     def add_headers(writer):
@@ -248,32 +300,35 @@ def delete_user(name, confirmed):
             """
                 Mark all task runs by the user as anonymous
                 Mark the user_ip field in the task_run by the username instead
-                to retain user identity for analytics
-            """
-            task_runs = TaskRun.query.filter_by(user_id=target_user['id']).all()
-            for task_run in task_runs:
-                task_run.user_id = None
-                task_run.user_ip = "deleted_user_"+target_user['name']
-                db.session.commit()
-
-            """
+                to retain user identity for analytics.
                 Change the ownership of all projects owned by the target user
-                to that of the current user
+                to that of the current user.
+                Delete the user from the database.
+                All three changes are made with set-based statements in a single transaction.
             """
-            projects = Project.query.filter_by(owner_id=target_user['id']).all()
-            for project in projects:
-                project.owner_id = current_user.id
+            try:
+                project_ids = [project_id for (project_id,) in Project.query.with_entities(Project.id)\
+                                                                      .filter_by(owner_id=target_user['id'])]
+
+                TaskRun.query.filter_by(user_id=target_user['id'])\
+                             .update({TaskRun.user_id: None,
+                                      TaskRun.user_ip: "deleted_user_" + target_user['name']},
+                                     synchronize_session=False)
+                if project_ids:
+                    Project.query.filter(Project.id.in_(project_ids))\
+                                 .update({Project.owner_id: current_user.id},
+                                         synchronize_session=False)
+
+                db.session.delete(user_object)
                 db.session.commit()
-                """
-                    Clean cached data about the project
-                """
-                cached_projects.clean_project(project.id)
+            except:
+                db.session.rollback()
+                raise
 
             """
-                Delete the user from the database
+                Clean cached data about the transferred projects
             """
-            db.session.delete(user_object)
-            db.session.commit()
+            clean_projects(project_ids)
 
             """
                 Clean user data from the cache
@@ -288,3 +343,18 @@ def delete_user(name, confirmed):
             abort(404)
     else:
         abort(404)
+
+
+def clean_projects(project_ids):
+    """Cleans the cached data of the specified projects.
+
+    PyBossa only cleans one project's cache at a time, so the projects are
+    cleaned together once the changes that affect them have been committed.
+
+    Args:
+        project_ids (list): A list of project identifiers.
+    """
+    from pybossa.cache import projects as cached_projects
+
+    for project_id in set(project_ids):
+        cached_projects.clean_project(project_id)
@@ -27,190 +27,790 @@
 # DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
 # OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE
 # OR OTHER DEALINGS IN THE SOFTWARE.
-from flask import Blueprint, current_app, jsonify
+from flask import Blueprint, Response, abort, current_app, request, stream_with_context
+from collections import OrderedDict
+from threading import Lock
+import json
+import zlib
 
 blueprint = Blueprint("geotagx-geojson-exporter", __name__)
 
+EXPORT_CACHE_KEY = "GEOTAGX-GEOJSON-EXPORT:{}:{}"
+"""The key to the Redis hash that holds a category's last exported GeoJSON document in a given summary mode, and its version."""
+
+EXPORT_CACHE_TIMEOUT = 24 * 60 * 60
+"""The number of seconds a category's last exported GeoJSON document is kept."""
+
+INDEX_CACHE_SIZE = 8
+"""The number of categories whose spatial index is kept in memory by each process."""
+
+_indexes = OrderedDict()
+"""The features and spatial indexes of the most recently filtered categories, in the order they were used."""
+
+_indexes_lock = Lock()
+
+_tile_cache = None
+
+VERSION_CACHE_TIMEOUT = 5
+"""The number of seconds each process reuses a category's project schemas and results version for."""
+
+VERSION_CACHE_SIZE = 64
+"""The number of categories whose project schemas and results version are kept in memory by each process."""
+
+_versions = OrderedDict()
+"""The project schemas and results version of the most recently requested categories, when they expire,
+in the order they were used."""
+
+_versions_lock = Lock()
+
 
 @blueprint.route("/project/category/<string:category_short_name>/export-geojson")
 def export_category_results(category_short_name):
     """Renders the specified category's results in GeoJSON format.
 
+    The results are served from each project's materialized summaries, and
+    streamed to the client as they are generated. Summaries that are out of
+    date are updated by a background job rather than by the request, so the
+    results include new task runs once the job is complete.
+
+    Each response is tagged with the version of the category's results. A client
+    that already holds the current version is sent a 304 (Not Modified) response,
+    and the last gzip-compressed document is served again until a new version
+    is available.
+
+    The results can be restricted to the features whose envelope intersects a
+    bounding box, given as "bbox=<min lon>,<min lat>,<max lon>,<max lat>", and
+    to the features that received contributions within a time window, given
+    as "since=<ISO 8601 time>" and/or "until=<ISO 8601 time>". Filtered results
+    are looked up in a spatial index of the category's features.
+
+    By default, a feature's geometry holds every volunteer's geolocation answer.
+    The "summary" parameter collapses these answers into their "centroid", their
+    convex "hull" or their merged footprint ("union").
+
     Args:
         category_short_name (str): A category's unique short name.
 
     Returns:
-        str: A GeoJSON formatted-string containing the specified category's results.
+        flask.Response: A response that streams a GeoJSON formatted-string containing the specified category's results.
+    """
+    import hashlib
+
+    filters = _get_filters()
+    summary_mode = _get_summary_mode()
+    project_schemas, results_version = _get_category_version(category_short_name)
+
+    version = results_version
+    if filters or summary_mode:
+        parameters = json.dumps({"filters": filters, "summary": summary_mode}, sort_keys=True)
+        version = hashlib.sha1(results_version + parameters).hexdigest()
+
+    accepts_gzip = request.accept_encodings["gzip"] > 0
+    content_length = None
+    response = None
+
+    if request.if_none_match.contains_weak(version):
+        response = Response(status=304)
+    elif filters:
+        features = _get_category_features(category_short_name, results_version, project_schemas, summary_mode)
+        chunks = _serialize(features.encode(i) for i in features.index.query(**filters))
+        if accepts_gzip:
+            chunks = _compress(chunks)
+    else:
+        from pybossa.core import sentinel
+
+        key = EXPORT_CACHE_KEY.format(category_short_name, summary_mode or "none")
+        cached_version, body = sentinel.master.hmget(key, ["version", "body"])
+        if cached_version == version and body is not None:
+            chunks = [body]
+            content_length = len(body)
+        else:
+            chunks = _cache(key, version, _compress(_export_category_results_as_geoJSON(project_schemas, summary_mode)))
+
+        if not accepts_gzip:
+            chunks = _decompress(chunks)
+            content_length = None
+
+    if response is None:
+        response = Response(stream_with_context(_prefetch(chunks)), mimetype="application/json")
+        if accepts_gzip:
+            response.headers["Content-Encoding"] = "gzip"
+        if content_length is not None:
+            response.headers["Content-Length"] = content_length
+
+    response.set_etag(version, weak=True)
+    response.vary.add("Accept-Encoding")
+    return response
+
+
+def _get_filters():
+    """Returns the filters specified in the request's query string.
+
+    The bounding box is clamped to the WGS 84 bounds, i.e. [-180, 180] x [-90, 90].
+
+    Returns:
+        dict: The bounding box ('bbox') and time window ('since' and 'until') filters, if specified.
     """
-    return _export_category_results_as_geoJSON(category_short_name)
+    from math import isinf, isnan
 
+    filters = {}
 
-def _export_category_results_as_geoJSON(category_name):
-    from pybossa.cache import projects as cached_projects
-    from pybossa.exporter.json_export import JsonExporter
-    import json
-    import pandas as pd
-    import numpy as np
-
-    geotagx_json_exporter = JsonExporter()
-
-    max_number_of_exportable_projects = 15
-    projects_in_category = cached_projects.get(category_name, page=1, per_page=max_number_of_exportable_projects)
-    task_runs = []
-    task_runs_info = []
-    project_name_id_mapping = {}
-    project_id_name_mapping = {}
-
-    project_question_type_mapping = {}
-    project_question_question_text_mapping = {}
-
-    for project in projects_in_category:
-        short_name = project['short_name']
-
-        project_id_name_mapping[project['id']] = project['short_name']
-        project_name_id_mapping[project['short_name']] = project['id']
-
-        # Check if it a supported geotagx project whose schema we know
-        if 'GEOTAGX_SUPPORTED_PROJECTS_SCHEMA' in current_app.config.keys() \
-            and short_name in current_app.config['GEOTAGX_SUPPORTED_PROJECTS_SCHEMA'].keys():
-
-            ##Read the project schema and store the respective questions and their types
-            for _question in current_app.config['GEOTAGX_SUPPORTED_PROJECTS_SCHEMA'][short_name]['questions']:
-                project_question_type_mapping[unicode(short_name+"::"+_question['answer']['saved_as'])] = _question['type']
-                project_question_question_text_mapping[unicode(short_name+"::"+_question['answer']['saved_as']+"::question_text")] = _question['title']
-
-            #Only export results of known GEOTAGX projects that are created with `geotagx-project-template`
-            task_runs_generator = geotagx_json_exporter.gen_json("task_run", project['id'])
-            _task_runs = ""
-            for task_run_c in task_runs_generator:
-                _task_runs += task_run_c
-
-            task_runs = task_runs + json.loads(_task_runs)
-
-    def extract_geotagx_info(json):
-        """Returns a list of only info objects of the task_run"""
-        exploded_json = []
-        for item in json:
-            item['info']['project_id'] = item['project_id']
-            exploded_json.append(item['info'])
-        return exploded_json
-
-    def _summarize_geolocations(geolocation_responses):
+    bbox = request.args.get("bbox")
+    if bbox is not None:
+        try:
+            bbox = [float(value) for value in bbox.split(",")]
+        except ValueError:
+            abort(400)
+        if len(bbox) != 4 or any(isinf(value) or isnan(value) for value in bbox):
+            abort(400)
+        if not (bbox[0] <= bbox[2] and bbox[1] <= bbox[3]):
+            abort(400)
+        filters["bbox"] = [
+            min(max(value, -limit), limit) for (value, limit) in zip(bbox, (180.0, 90.0, 180.0, 90.0))
+        ]
+
+    for name in ["since", "until"]:
+        value = request.args.get(name)
+        if value is not None:
+            filters[name] = _parse_time(value, end_of_day=(name == "until"))
+
+    return filters
+
+
+def _get_summary_mode():
+    """Returns the geometry summary mode specified in the request's query string.
+
+    Returns:
+        str | None: One of geo.geometry.SUMMARY_MODES, or None if no summary was requested.
+    """
+    from ..geo.geometry import SUMMARY_MODES, is_available
+
+    summary_mode = request.args.get("summary")
+    if summary_mode is not None and summary_mode not in SUMMARY_MODES:
+        abort(400)
+    elif summary_mode is not None and not is_available(summary_mode):
+        abort(501)
+
+    return summary_mode
+
+
+def _parse_time(value, end_of_day=False):
+    """Parses the specified ISO 8601 date or time.
+
+    Args:
+        value (str): A date (YYYY-MM-DD) or a time (YYYY-MM-DDTHH:MM:SS[.ffffff]).
+        end_of_day (bool): If set to True, a date is interpreted as the last instant of that day
+            rather than the first.
+
+    Returns:
+        str: The time in the format of a task run's finish time.
+    """
+    from datetime import datetime, time
+
+    for time_format in ["%Y-%m-%dT%H:%M:%S.%f", "%Y-%m-%dT%H:%M:%S", "%Y-%m-%d"]:
+        try:
+            result = datetime.strptime(value, time_format)
+        except ValueError:
+            continue
+
+        if end_of_day and time_format == "%Y-%m-%d":
+            result = datetime.combine(result.date(), time.max)
+        return result.strftime("%Y-%m-%dT%H:%M:%S.%f")
+
+    abort(400)
+
+
+@blueprint.route("/project/category/<string:category_short_name>/tiles/<int:z>/<int:x>/<int:y>.geojson")
+def export_category_tile(category_short_name, z, x, y):
+    """Renders a map tile of the specified category's results in GeoJSON format.
+
+    A tile holds the category's features that intersect it, clipped to its bounds
+    and simplified to its resolution. Tiles are cached on disk, and the geometry
+    of the lowest zoom levels is simplified once per version of the results.
+
+    Args:
+        category_short_name (str): A category's unique short name.
+        z (int): The tile's zoom level.
+        x (int): The tile's column.
+        y (int): The tile's row.
+
+    Returns:
+        flask.Response: A response containing a GeoJSON FeatureCollection.
+    """
+    from ..geo import tiles
+
+    if not (0 <= z <= tiles.MAX_ZOOM and 0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        abort(404)
+
+    project_schemas, version = _get_category_version(category_short_name)
+
+    if request.if_none_match.contains_weak(version):
+        response = Response(status=304)
+    else:
+        tile_cache = _get_tile_cache()
+        tile = tile_cache.get(category_short_name, version, z, x, y)
+        if tile is None:
+            features = _get_category_features(category_short_name, version, project_schemas)
+            tile = "".join(_compress(features.get_tile(z, x, y)))
+            tile_cache.put(category_short_name, version, z, x, y, tile)
+
+        if request.accept_encodings["gzip"] > 0:
+            response = Response(tile, mimetype="application/json")
+            response.headers["Content-Encoding"] = "gzip"
+        else:
+            response = Response("".join(_decompress([tile])), mimetype="application/json")
+
+    response.set_etag(version, weak=True)
+    response.vary.add("Accept-Encoding")
+    return response
+
+
+def _get_tile_cache():
+    """Returns the tile cache.
+
+    Returns:
+        geo.tiles.TileCache: The cache configured by GEOTAGX_TILE_CACHE_FOLDER and GEOTAGX_TILE_CACHE_SIZE.
+    """
+    from ..geo.tiles import TileCache
+
+    global _tile_cache
+    folder = current_app.config["GEOTAGX_TILE_CACHE_FOLDER"]
+    if _tile_cache is None or _tile_cache.folder != folder:
+        _tile_cache = TileCache(folder, current_app.config["GEOTAGX_TILE_CACHE_SIZE"])
+    return _tile_cache
+
+
+def _get_category_features(category_name, version, project_schemas, summary_mode=None):
+    """Returns the specified category's features.
+
+    The features and their spatial index are built the first time they are requested,
+    and rebuilt once the category's results change version.
+
+    Args:
+        category_name (str): A category's unique short name.
+        version (str): The version of the category's results.
+        project_schemas (dict): A mapping of the category's project identifiers to compiled project schemas.
+        summary_mode (str): The features' geometry summary mode, if any.
+
+    Returns:
+        _CategoryFeatures: The category's features.
+    """
+    # The index is keyed by the category and summary mode only, and checked against the version
+    # of the results rather than that of the response, which also covers the request's filters.
+    # Otherwise, each new bounding box or time window would rebuild the index.
+    key = (category_name, summary_mode)
+    with _indexes_lock:
+        features = _indexes.pop(key, None)
+        if features is not None and features.version == version:
+            _indexes[key] = features
+            return features
+
+    features = _CategoryFeatures(version, _generate_features(project_schemas, summary_mode))
+
+    with _indexes_lock:
+        _indexes[key] = features
+        while len(_indexes) > INDEX_CACHE_SIZE:
+            _indexes.popitem(last=False)
+
+    return features
+
+
+class _CategoryFeatures(object):
+    """A category's GeoJSON-encoded features and the spatial index over them.
+    """
+    PRESIMPLIFIED_MAX_ZOOM = 8
+    """The highest zoom level whose simplified geometry is kept rather than computed for each tile."""
+
+    def __init__(self, version, features):
+        """Encodes and indexes the specified features.
+
+        Args:
+            version (str): The version of the category's results.
+            features (iterable): The category's features, as generated by _generate_features.
         """
-            TODO :: Add different geo-summarization methods (ConvexHull, Centroid, etc)
+        import numpy as np
+        from ..geo.index import GridIndex, get_envelope
+
+        self.version = version
+        self.geometries = []
+        self.properties = []
+        self.rings = []
+        self._simplified_rings = {}
+
+        envelopes, first, last = [], [], []
+        for feature, feature_first, feature_last in features:
+            coordinates = feature["geometry"]["coordinates"]
+            self.geometries.append(json.dumps(feature["geometry"], sort_keys=True))
+            self.properties.append(json.dumps(feature["properties"], sort_keys=True))
+            if feature["geometry"]["type"] == "MultiPolygon":
+                self.rings.append([np.asarray(ring, dtype=np.float64) for polygon in coordinates for ring in polygon if ring])
+            else:
+                self.rings.append([])
+            envelopes.append(get_envelope(coordinates))
+            first.append(feature_first)
+            last.append(feature_last)
+
+        self.index = GridIndex(envelopes, first, last)
+
+    def encode(self, i):
+        """Returns the specified feature, encoded in GeoJSON.
+
+        Args:
+            i (int): The feature's index.
+
+        Returns:
+            str: The GeoJSON-encoded feature.
         """
-        responses = []
+        return self._encode(self.geometries[i], self.properties[i])
+
+    def get_tile(self, z, x, y):
+        """Generates the specified map tile.
+
+        Args:
+            z (int): The tile's zoom level.
+            x (int): The tile's column.
+            y (int): The tile's row.
 
-        for response in geolocation_responses:
-            if type(response) == type([]):
-                responses.append(response)
-
-        return responses
-
-    """
-        Changes projection to WGS84 projection  from WebMercator projection
-        so that most geojson renderers support it out of the box
-        Inspired by : http://www.gal-systems.com/2011/07/convert-coordinates-between-web.html
+        Returns:
+            generator: The chunks of the tile's GeoJSON-formatted FeatureCollection.
+        """
+        from ..geo import tiles
+
+        bounds = tiles.get_tile_bounds(z, x, y)
+        tolerance = tiles.get_tolerance(z)
+
+        def generate_features():
+            for i in self.index.query(bbox=bounds):
+                rings = []
+                for ring in self._get_rings(i, z):
+                    ring = tiles.clip_ring(ring, bounds)
+                    if ring is not None and z > self.PRESIMPLIFIED_MAX_ZOOM:
+                        ring = tiles.simplify_ring(ring, tolerance)
+                    if ring is not None:
+                        rings.append(ring.tolist())
+
+                if rings:
+                    geometry = {"type": "MultiPolygon", "coordinates": [rings]}
+                    yield self._encode(json.dumps(geometry, sort_keys=True), self.properties[i])
+
+        return _serialize(generate_features())
+
+    def _get_rings(self, i, z):
+        """Returns the specified feature's rings, simplified for the specified zoom level if it is low enough.
+        """
+        from ..geo.tiles import get_tolerance, simplify_ring
+
+        if z > self.PRESIMPLIFIED_MAX_ZOOM:
+            return self.rings[i]
+
+        simplified_rings = self._simplified_rings.get(z)
+        if simplified_rings is None:
+            tolerance = get_tolerance(z)
+            simplified_rings = [
+                [r for r in (simplify_ring(ring, tolerance) for ring in rings) if r is not None]
+                for rings in self.rings
+            ]
+            self._simplified_rings[z] = simplified_rings
+
+        return simplified_rings[i]
+
+    @staticmethod
+    def _encode(geometry, properties):
+        """Returns a GeoJSON-encoded feature made of the specified GeoJSON-encoded geometry and properties.
+        """
+        return '{"geometry": %s, "properties": %s, "type": "Feature"}' % (geometry, properties)
+
+
+def _export_category_results_as_geoJSON(project_schemas, summary_mode=None):
+    """Generates the specified projects' results as a GeoJSON FeatureCollection.
+
+    The document holds the same features and properties as it did when it was
+    rendered with flask.jsonify, but it is serialized without indentation and
+    its features are ordered by image URL, so that a version of the results is
+    always rendered as the same document.
+
+    Args:
+        project_schemas (dict): A mapping of project identifiers to compiled project schemas.
+        summary_mode (str): The features' geometry summary mode, if any.
+
+    Returns:
+        generator: The chunks of the GeoJSON-formatted FeatureCollection.
     """
-    def _project_coordinate_from_webmercator_toWGS84(coordinates):
-        import math
+    features = _generate_features(project_schemas, summary_mode)
+    return _serialize(json.dumps(feature, sort_keys=True) for feature, _, _ in features)
+
+
+def _serialize(features):
+    """Serializes the specified GeoJSON-encoded features as a FeatureCollection.
 
-        mercatorX_lon = coordinates[0]
-        mercatorY_lat = coordinates[1]
+    Args:
+        features (iterable): The GeoJSON-encoded features.
+
+    Yields:
+        str: A chunk of the GeoJSON-formatted FeatureCollection.
+    """
+    # The first feature is generated along with the first chunk, so that _prefetch
+    # can run into any error that is raised while the features are being loaded.
+    header = '{"features": ['
+    separator = header
+    for feature in features:
+        yield separator + feature
+        separator = ", "
 
-        if math.fabs(mercatorX_lon) < 180 and math.fabs(mercatorY_lat) < 90:
-            return False, False
+    if separator is header:
+        yield header
+    yield '], "type": "FeatureCollection"}'
 
-        if ((math.fabs(mercatorX_lon) > 20037508.3427892) or (math.fabs(mercatorY_lat) > 20037508.3427892)):
-            return False, False
 
-        x = mercatorX_lon
-        y = mercatorY_lat
-        num3 = x / 6378137.0
-        num4 = num3 * 57.295779513082323
-        num5 = math.floor(float((num4 + 180.0) / 360.0))
-        num6 = num4 - (num5 * 360.0)
-        num7 = 1.5707963267948966 - (2.0 * math.atan(math.exp((-1.0 * y) / 6378137.0)));
-        mercatorX_lon = num6
-        mercatorY_lat = num7 * 57.295779513082323
+def _prefetch(chunks):
+    """Generates the first of the specified chunks ahead of the others.
 
-        return mercatorX_lon, mercatorY_lat
+    A response's status is sent along with its first chunk, so generating it
+    beforehand allows an error to be reported with a 500 (Internal Server
+    Error) response rather than a truncated 200 (OK) response. An error that
+    is raised past the first chunk is logged before the stream is closed.
 
+    Args:
+        chunks (iterable): The chunks to generate.
+
+    Returns:
+        generator: The chunks.
+    """
+    chunks = iter(chunks)
+    first_chunk = next(chunks, None)
+
+    def generate():
+        if first_chunk is not None:
+            yield first_chunk
+        try:
+            for chunk in chunks:
+                yield chunk
+        except Exception:
+            current_app.logger.exception("The GeoJSON export was interrupted.")
+            raise
+
+    return generate()
+
+
+def _generate_features(project_schemas, summary_mode=None):
+    """Generates the specified projects' results as GeoJSON features.
+
+    Each project's stored summaries are loaded, after which the features are
+    built one image at a time. Like the category's DataFrame used
+    to, a feature only holds the questions that were answered in at least one
+    of the category's task runs.
+
+    Args:
+        project_schemas (dict): A mapping of project identifiers to compiled project schemas.
+        summary_mode (str): The features' geometry summary mode, if any.
+
+    Yields:
+        tuple: A GeoJSON feature and the finish times of the first and last task runs it summarizes.
+    """
+    summaries = {}
+    answered_keys = set()
+    for project_id, project_summaries in _get_summaries(project_schemas.keys()):
+        for img_url, summary in project_summaries.iteritems():
+            summaries.setdefault(img_url, {})[project_id] = summary
+            answered_keys.update(summary["answers"])
+            answered_keys.update(summary["geolocations"])
+
+    for img_url in sorted(summaries):
+        summary = summaries.pop(img_url)
+        feature = _build_feature(img_url, summary, project_schemas, answered_keys, summary_mode)
+        if feature is not None:
+            first = [s["first"] for s in summary.itervalues() if s.get("first") is not None]
+            last = [s["last"] for s in summary.itervalues() if s.get("last") is not None]
+            yield feature, min(first) if first else None, max(last) if last else None
+
+
+def _get_category_version(category_name):
+    """Returns the schemas of the specified category's supported projects, and the version of its results.
+
+    Both are reused for VERSION_CACHE_TIMEOUT seconds, so that the requests for a
+    map's tiles, which come in bursts, compute them once rather than once per tile.
+    Before they are computed, the category is looked up, so that unknown names,
+    which come from the URL, are neither cached nor used as cache keys.
+
+    Args:
+        category_name (str): A category's unique short name.
+
+    Raises:
+        werkzeug.exceptions.NotFound: If the category does not exist.
+
+    Returns:
+        tuple: A mapping of project identifiers to compiled project schemas, and the version of their results.
+    """
+    from time import time
+
+    now = time()
+    with _versions_lock:
+        entry = _versions.pop(category_name, None)
+        if entry is not None:
+            _versions[category_name] = entry
+
+    if entry is not None and entry[0] > now:
+        _, project_schemas, version = entry
+    else:
+        from pybossa.core import project_repo
+
+        if project_repo.get_category_by(short_name=category_name) is None:
+            abort(404)
+
+        project_schemas = _get_project_schemas(category_name)
+        version = _get_version(project_schemas)
+        with _versions_lock:
+            _versions.pop(category_name, None)
+            _versions[category_name] = (now + VERSION_CACHE_TIMEOUT, project_schemas, version)
+            while len(_versions) > VERSION_CACHE_SIZE:
+                _versions.popitem(last=False)
+
+    return project_schemas, version
+
+
+def _get_project_schemas(category_name):
+    """Returns the schemas of the specified category's supported projects.
+
+    Only known GeoTag-X projects that are created with `geotagx-project-template` are exported.
+
+    Args:
+        category_name (str): A category's unique short name.
+
+    Returns:
+        dict: A mapping of project identifiers to compiled project schemas.
+    """
+    from ..schema import registry
+
+    project_schemas = {}
+    for project in _get_projects(category_name):
+        schema = registry.get(project["short_name"])
+        if schema is not None:
+            project_schemas[project["id"]] = schema
+
+    return project_schemas
+
+
+def _get_version(project_schemas):
+    """Returns the version of the specified projects' results.
+
+    The version is derived from the projects' identifiers and schemas, as well as
+    the version of their stored summaries. The projects whose summaries are out of
+    date are scheduled for an update, which changes the version once it is complete.
+
+    Args:
+        project_schemas (dict): A mapping of project identifiers to compiled project schemas.
+
+    Returns:
+        str: The version of the projects' results.
+    """
+    import hashlib
+    from ..geo import store
+    from ..jobs import enqueue_geojson_summaries_update
+    from ..schema import registry
+
+    project_ids = sorted(project_schemas)
+
+    outdated, invalid = store.find_outdated(project_ids)
+    for project_id in outdated:
+        enqueue_geojson_summaries_update(project_id)
+    for project_id in invalid:
+        enqueue_geojson_summaries_update(project_id, rebuild=True)
+
+    version = "{}:{}:{}".format(registry.get_fingerprint(), project_ids, store.get_versions(project_ids))
+    return hashlib.sha1(version).hexdigest()
+
+
+def _compress(chunks):
+    """Compresses the specified chunks in gzip format.
+
+    Args:
+        chunks (iterable): The chunks to compress.
+
+    Yields:
+        str: A chunk of compressed data.
     """
-        Changes the projection of the multi_polygon object to WGS84 from WebMercator
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        compressed_chunk = compressor.compress(chunk)
+        if compressed_chunk:
+            yield compressed_chunk
+
+    yield compressor.flush()
+
+
+def _decompress(chunks):
+    """Decompresses the specified gzip-compressed chunks.
+
+    Args:
+        chunks (iterable): The chunks to decompress.
+
+    Yields:
+        str: A chunk of decompressed data.
     """
-    def _project_geosummary_from_webmercator_to_WGS84(multi_polygon):
-        _multi_polygon = []
-        for polygon in multi_polygon:
-            _polygon = []
-            for coordinates in polygon:
-                try:
-                    _x, _y = _project_coordinate_from_webmercator_toWGS84(coordinates)
-                    if _x and _y:
-                        _polygon.append([_x, _y])
-                except:
-                    pass # Pass Silentily if there is some error in the input
-            _multi_polygon.append(_polygon)
-        return _multi_polygon
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        yield decompressor.decompress(chunk)
 
-    def _build_geo_json(geolocation_responses):
-        geoJSON = {}
-        geoJSON['type'] = "FeatureCollection"
-        geoJSON['features'] = []
-        for response in geolocation_responses:
-            if response['_geotagx_geolocation_key']:
-                geo_summary = response[response['_geotagx_geolocation_key']]
-                _feature = {}
-                _feature['type'] = "Feature"
-                _feature['geometry'] = {}
+    yield decompressor.flush()
 
-                _feature['geometry']['type'] = "MultiPolygon"
-                _feature['geometry']['coordinates'] = \
-                    [_project_geosummary_from_webmercator_to_WGS84(geo_summary['geo_summary'])]
 
-                del response[response['_geotagx_geolocation_key']]
-                del response['_geotagx_geolocation_key']
-                _feature['properties'] = response
+def _cache(key, version, chunks):
+    """Passes the specified compressed chunks through, then caches the document they make up.
 
-                #Neglect responses with no coordinate labels
-                if _feature['geometry']['coordinates'] != [[]]:
-                    geoJSON['features'].append(_feature)
+    Args:
+        key (str): The key to the Redis hash that holds the cached document.
+        version (str): The document's version.
+        chunks (iterable): The document's compressed chunks.
+
+    Yields:
+        str: A chunk of compressed data.
+    """
+    from pybossa.core import sentinel
 
-        return geoJSON
+    body = []
+    for chunk in chunks:
+        body.append(chunk)
+        yield chunk
 
-    task_runs_info = extract_geotagx_info(task_runs)
-    task_runs_info = pd.read_json(json.dumps(task_runs_info))
+    pipeline = sentinel.master.pipeline()
+    pipeline.hmset(key, {"version": version, "body": "".join(body)})
+    pipeline.expire(key, EXPORT_CACHE_TIMEOUT)
+    pipeline.execute()
 
-    summary_dict = {}
-    for img_url in task_runs_info['img'].unique():
-        per_url_data = task_runs_info[task_runs_info['img'] == img_url]
 
-        for project_id in np.unique(per_url_data['project_id'].values):
+def _get_projects(category_name, per_page=100):
+    """Returns all projects in the specified category, one page at a time.
+
+    Args:
+        category_name (str): A category's unique short name.
+        per_page (int): The number of projects to retrieve per page.
+
+    Yields:
+        dict: A project in the category.
+    """
+    from pybossa.cache import projects as cached_projects
+
+    page = 1
+    while True:
+        projects = cached_projects.get(category_name, page=page, per_page=per_page)
+        for project in projects:
+            yield project
+
+        if len(projects) < per_page:
+            break
+        page += 1
+
+
+def _get_summaries(project_ids):
+    """Returns the stored summaries of the projects with the specified identifiers.
+
+    The projects are split into at most GEOTAGX_GEOJSON_EXPORT_CONCURRENCY groups,
+    which are loaded concurrently by a pool of as many threads, each group in a
+    single round trip, so that the time it takes is close to that of the largest
+    group rather than the sum of all projects.
+
+    Args:
+        project_ids (list): A list of project identifiers.
+
+    Returns:
+        list: A list of <project identifier, summaries> pairs.
+    """
+    from multiprocessing.pool import ThreadPool
+    from ..geo import store
 
-            per_summary_dict = {}
-            per_summary_dict['_geotagx_geolocation_key'] = False
+    project_ids = list(project_ids)
+    concurrency = min(current_app.config["GEOTAGX_GEOJSON_EXPORT_CONCURRENCY"], len(project_ids))
+    if concurrency <= 1:
+        return zip(project_ids, store.load_many(project_ids))
 
-            if img_url in summary_dict.keys():
-                per_summary_dict = summary_dict[img_url]
+    groups = [project_ids[i::concurrency] for i in xrange(concurrency)]
+    pool = ThreadPool(concurrency)
+    try:
+        loaded = pool.map(store.load_many, groups)
+    finally:
+        pool.close()
+        pool.join()
 
-            per_summary_dict['GEOTAGX_IMAGE_URL'] = img_url
-            per_url_data_project_slice = per_url_data[per_url_data['project_id'] == project_id]
+    summaries = {}
+    for group, group_summaries in zip(groups, loaded):
+        summaries.update(zip(group, group_summaries))
+
+    return [(project_id, summaries[project_id]) for project_id in project_ids]
+
+
+def _build_feature(img_url, summary, project_schemas, answered_keys, summary_mode=None):
+    """Builds the GeoJSON feature for the image with the specified URL.
+
+    Args:
+        img_url (unicode): The image's URL.
+        summary (dict): The image's per-project summaries.
+        project_schemas (dict): A mapping of project identifiers to compiled project schemas.
+        answered_keys (set): The keys of the questions that were answered in the category's task runs.
+        summary_mode (str): The feature's geometry summary mode, if any.
+
+    Returns:
+        dict | None: A GeoJSON feature, or None if the image has no geolocation answers.
+    """
+    from ..geo.projection import project_rings
+
+    properties = {u"GEOTAGX_IMAGE_URL": img_url}
+    geolocation_key = None
+
+    for project_id in sorted(summary):
+        per_project_summary = summary[project_id]
+        schema = project_schemas[project_id]
+
+        properties[schema.total_key] = per_project_summary["total"]
+
+        answers = per_project_summary["answers"]
+        geolocations = per_project_summary["geolocations"]
+        for question in schema.questions:
+            if question.key not in answered_keys:
+                continue
+            elif question.type == u"geotagging":
+                geolocation_key = question.namespaced_key
+                properties[geolocation_key] = {
+                    "geo_summary": geolocations.get(question.key, []),
+                    "question_text": question.title,
+                }
+            else:
+                properties[question.namespaced_key] = {
+                    "answer_summary": answers.get(question.key, {}),
+                    "question_text": question.title,
+                }
+
+    if geolocation_key is None:
+        return None
+
+    rings = project_rings(properties.pop(geolocation_key)["geo_summary"])
+
+    # Neglect responses with no coordinate labels.
+    if not rings:
+        return None
+
+    geometry = _summarize_geolocations(rings, summary_mode)
+    if geometry is None:
+        return None
+
+    return {
+        "type": "Feature",
+        "geometry": geometry,
+        "properties": properties,
+    }
+
+
+def _summarize_geolocations(rings, summary_mode=None):
+    """Returns the GeoJSON geometry that summarizes the specified geolocation answers.
+
+    Args:
+        rings (list): The WGS84 rings drawn by the volunteers.
+        summary_mode (str): One of geo.geometry.SUMMARY_MODES, or None to keep every ring.
+
+    Returns:
+        dict | None: A GeoJSON geometry, or None if the rings can not be summarized.
+    """
+    if summary_mode is None:
+        return {"type": "MultiPolygon", "coordinates": [rings]}
 
-            for key in per_url_data_project_slice.keys():
-                namespaced_key = project_id_name_mapping[project_id]+"::"+key
-                if key not in ['img', 'isMigrated', 'son_app_id', 'task_id', 'project_id']:
-                    if namespaced_key in project_question_type_mapping.keys():
-                        if project_question_type_mapping[namespaced_key] == u"geotagging":
-                            per_summary_dict['_geotagx_geolocation_key'] = namespaced_key
-                            per_summary_dict[namespaced_key] = {'geo_summary' : _summarize_geolocations(per_url_data_project_slice[key].values)}
-                        else:
-                            per_summary_dict[namespaced_key] = {'answer_summary':dict(per_url_data_project_slice[key].value_counts())}
-                        per_summary_dict[namespaced_key]['question_text'] = project_question_question_text_mapping[unicode(namespaced_key+"::question_text")]
-
-                elif key == u"img":
-                    per_summary_dict[project_id_name_mapping[project_id]+"::GEOTAGX_TOTAL"] = len(per_url_data_project_slice)
-
-            summary_dict[img_url] = per_summary_dict
-
-    geo_json = _build_geo_json(summary_dict.values())
-    return jsonify(geo_json)
+    from ..geo.geometry import summarize
+    return summarize(rings, summary_mode)
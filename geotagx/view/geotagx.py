@@ -25,13 +25,13 @@
 # OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE
 # OR OTHER DEALINGS IN THE SOFTWARE.
 """ Custom Geotagx functionalities for Pybossa"""
-from flask import Blueprint, url_for, flash, redirect, current_app, render_template, abort
+from flask import Blueprint, url_for, flash, redirect, current_app, render_template, abort, jsonify
 from pybossa.model.task_run import TaskRun
-from pybossa.model.task import Task
 from pybossa.auth import ensure_authorized_to
-from pybossa.core import db, task_repo
+from pybossa.core import task_repo
 from pybossa.cache import projects as cached_projects
 from pybossa.view import projects as projects_view
+from ..schema import registry as schema_registry
 from flask.ext.login import current_user
 
 blueprint = Blueprint('geotagx', __name__)
@@ -43,22 +43,21 @@ def flush_task_runs(project_short_name, confirmed):
 	project = cached_projects.get_project(project_short_name)
 	if current_user.admin or project.owner_id == current_user.id:
 		if confirmed == "confirmed":
-			associated_task_runs = TaskRun.query.filter_by(project_id=project.id).all()
-			for task_run in associated_task_runs:
-				db.session.delete(task_run)
-				pass
-			db.session.commit()
-
-			# Iterate over all tasks associated with the project, and mark them as 'ongoing'
-			# Some tasks might be marked as 'completed' if enough task_runs were done
-			associated_tasks = Task.query.filter_by(project_id=project.id).all()
-			for task in associated_tasks:
-				if task.state != u"ongoing":
-					task.state = u"ongoing"
-					db.session.commit()
-
-			# Reset project data in the cache
-			cached_projects.clean_project(project.id)
+			from ..jobs import enqueue_flush_task_runs, flush_task_runs_now
+
+			# Large projects are flushed by a background job, whose progress can be polled.
+			n_task_runs = TaskRun.query.filter_by(project_id=project.id).count()
+			if n_task_runs > current_app.config["GEOTAGX_FLUSH_TASK_RUNS_JOB_THRESHOLD"]:
+				status_url = url_for('.flush_task_runs_status', project_short_name=project_short_name)
+				if enqueue_flush_task_runs(project.id):
+					flash('The Task Runs associated with this project are being deleted. The progress is available at <a href="{0}">{0}</a>.'.format(status_url), 'info')
+				else:
+					flash('The Task Runs associated with this project are already being deleted. The progress is available at <a href="{0}">{0}</a>.'.format(status_url), 'warning')
+				return redirect(url_for('project.task_settings', short_name = project_short_name))
+
+			# Delete the task runs and mark every task as 'ongoing' with set-based statements,
+			# then reset the project's data in the cache.
+			flush_task_runs_now(project.id)
 			# Note: The cache will hold the old data about the users who contributed
 			# to the tasks associated with this projects till the User Cache Timeout.
 			# Querying the list of contributors to this project, and then individually updating
@@ -85,12 +84,33 @@ def flush_task_runs(project_short_name, confirmed):
 	else:
 		abort(404)
 
+
+@blueprint.route('/project/<project_short_name>/flush_task_runs_status')
+def flush_task_runs_status(project_short_name):
+	"""Returns the progress of the project's task run flush as JSON.
+
+	The response contains the flush's status ("queued", "running", "finished" or "failed"),
+	and its total and deleted number of task runs.
+	"""
+	from ..jobs import get_flush_task_runs_status
+
+	project = cached_projects.get_project(project_short_name)
+	if project is None or not (current_user.admin or project.owner_id == current_user.id):
+		abort(404)
+
+	status = get_flush_task_runs_status(project.id)
+	if status is None:
+		abort(404)
+
+	return jsonify(status)
+
+
 @blueprint.route('/visualize/<short_name>/<int:task_id>')
 def visualize(short_name, task_id):
   """Return a file with all the TaskRuns for a given Task"""
   # Check if it a supported geotagx project whose schema we know
-  if 'GEOTAGX_SUPPORTED_PROJECTS_SCHEMA' in current_app.config.keys() \
-		and short_name in current_app.config['GEOTAGX_SUPPORTED_PROJECTS_SCHEMA'].keys():
+  schema = schema_registry.get(short_name)
+  if schema is not None:
 	  # Check if the project exists
 	  (project, owner, n_tasks, n_task_runs,
 	   overall_progress, last_activity) = projects_view.project_by_shortname(short_name)
@@ -116,8 +136,7 @@ def visualize(short_name, task_id):
 			                           n_volunteers=cached_projects.n_volunteers(project.id),
 			                           task_info = task.info,
 			                           task_runs_json = results,
-			                           geotagx_project_template_schema = \
-			                           	current_app.config['GEOTAGX_SUPPORTED_PROJECTS_SCHEMA'][short_name])
+			                           geotagx_project_template_schema = schema.raw)
 	  else:
 	      return abort(404)
   else:
@@ -128,4 +147,10 @@ def visualize(short_name, task_id):
 def map_summary(category_short_name):
     from pybossa.core import project_repo
     category = project_repo.get_category_by(short_name=category_short_name)
-    return render_template("/geotagx/map_summary/summary.html", active_cat=category)
+
+    # The URL template of the category's map tiles, e.g. for Leaflet's L.tileLayer.
+    tile_url = url_for("geotagx-geojson-exporter.export_category_tile",
+                       category_short_name=category_short_name, z=0, x=0, y=0)
+    tile_url = tile_url.replace("/0/0/0.geojson", "/{z}/{x}/{y}.geojson")
+
+    return render_template("/geotagx/map_summary/summary.html", active_cat=category, tile_url=tile_url)
@@ -26,6 +26,8 @@
 # OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE
 # OR OTHER DEALINGS IN THE SOFTWARE.
 from flask import Blueprint, render_template
+from pybossa.cache import memoize, delete_memoized
+from pybossa.core import timeouts
 
 blueprint = Blueprint("geotagx-project-browser", __name__, url_prefix="/browse")
 """The view's blueprint."""
@@ -37,8 +39,24 @@ def setup(application):
     Args:
         application (werkzeug.local.LocalProxy): The current Flask application's instance.
     """
+    from sqlalchemy import event
+    from sqlalchemy.orm import Session
+    from pybossa.model.project import Project
+
     application.register_blueprint(blueprint)
 
+    # The cached projects are invalidated whenever a change to a project is committed.
+    listeners = [
+        (Project, "after_insert", _on_project_changed),
+        (Project, "after_update", _on_project_changed),
+        (Project, "after_delete", _on_project_changed),
+        (Session, "after_commit", _on_session_committed),
+        (Session, "after_rollback", _on_session_rolled_back),
+    ]
+    for (target, identifier, listener) in listeners:
+        if not event.contains(target, identifier, listener):
+            event.listen(target, identifier, listener)
+
 
 @blueprint.route("/")
 def index():
@@ -53,6 +71,12 @@ def index():
 def _get_cached_categories():
     """Returns all cached categories.
 
+    The returned categories are copies of the cached ones, to which a list of
+    their published projects is added. The projects' progress, number of tasks
+    and number of volunteers are read from PyBossa's per-project caches rather
+    than from the cached list, as those caches are cleaned whenever a project's
+    tasks or task runs change, e.g. by pybossa.cache.projects.clean_project.
+
     Returns:
         list: A list of all cached categories.
     """
@@ -68,7 +92,99 @@ def _get_cached_categories():
         }
         categories = filter(lambda c: c["short_name"] not in restricted_categories, categories)
 
-    for category in categories:
-        category["projects"] = cached_projects.get_all(category["short_name"])
+    projects = _get_browsable_projects(tuple(sorted(c["short_name"] for c in categories)))
+
+    def with_stats(project):
+        return dict(project,
+                    overall_progress=cached_projects.overall_progress(project["id"]),
+                    n_tasks=cached_projects.n_tasks(project["id"]),
+                    n_volunteers=cached_projects.n_volunteers(project["id"]))
+
+    return [
+        dict(category, projects=[with_stats(project) for project in projects.get(category["short_name"], [])])
+        for category in categories
+    ]
+
+
+@memoize(timeout=timeouts.get("APP_TIMEOUT"))
+def _get_browsable_projects(category_short_names):
+    """Returns the published projects of the specified categories.
+
+    This is modelled after pybossa.cache.projects.get_all, but fetches the
+    projects of every category with a single query, and leaves out the projects'
+    statistics, which change far more often than the list itself.
+
+    The list is invalidated whenever a change to a project is committed through
+    the ORM. A change that is made by a bulk statement, e.g. the update time that
+    the sourcerer sets when it creates tasks, is only visible once the list expires.
+
+    Args:
+        category_short_names (tuple): A sorted tuple of category short names.
+
+    Returns:
+        dict: A mapping of category short names to lists of projects sorted by name.
+    """
+    from sqlalchemy import text
+    from pybossa.core import db
+    from pybossa.util import pretty_date
+
+    if not category_short_names:
+        return {}
 
-    return categories
+    sql = text('''
+       SELECT category.short_name AS category_short_name,
+       project.id, project.name, project.short_name,
+       project.description, project.info, project.created, project.updated,
+       project.category_id, project.featured, "user".fullname AS owner
+       FROM "user", project
+       LEFT OUTER JOIN category ON project.category_id=category.id
+       WHERE
+       category.short_name = ANY(:categories)
+       AND "user".id=project.owner_id
+       AND project.published=true
+       AND (project.info->>'passwd_hash') IS NULL
+       GROUP BY category.short_name, project.id, "user".id ORDER BY project.name;''')
+
+    projects = {}
+    for row in db.session.execute(sql, dict(categories=list(category_short_names))):
+        project = dict(id=row.id, name=row.name, short_name=row.short_name,
+                       created=row.created, description=row.description,
+                       updated=row.updated,
+                       last_activity=pretty_date(row.updated),
+                       last_activity_raw=row.updated,
+                       info=row.info, owner=row.owner,
+                       featured=row.featured, category_id=row.category_id)
+        projects.setdefault(row.category_short_name, []).append(project)
+
+    return projects
+
+
+def _on_project_changed(mapper, connection, project):
+    """Marks the session that created, updated or deleted a project.
+
+    This is a listener for the Project model's SQLAlchemy mapper events. The
+    cached projects are invalidated once the session's changes are committed,
+    so that they cannot be cached again before the changes are visible.
+    """
+    from sqlalchemy.orm import object_session
+
+    session = object_session(project)
+    if session is not None:
+        session.info["geotagx_browsable_projects_changed"] = True
+
+
+def _on_session_committed(session):
+    """Invalidates the cached projects if the committed session changed a project.
+
+    This is a listener for the SQLAlchemy Session's after_commit event.
+    """
+    if session.info.pop("geotagx_browsable_projects_changed", False):
+        delete_memoized(_get_browsable_projects)
+
+
+def _on_session_rolled_back(session):
+    """Discards the project changes of a session that was rolled back.
+
+    This is a listener for the SQLAlchemy Session's after_rollback event.
+    """
+    session.info.pop("geotagx_browsable_projects_changed", None)
@@ -24,19 +24,50 @@
 # DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
 # OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE
 # OR OTHER DEALINGS IN THE SOFTWARE.
-from flask import Blueprint, request, current_app, render_template, jsonify
+from flask import Blueprint, request, current_app, render_template, jsonify, abort
 from flask.ext.login import login_required
+from pybossa.model import make_timestamp
 from pybossa.model.task import Task
 from pybossa.model.project import Project
 from pybossa.model.category import Category
-from pybossa.util import admin_required
-from pybossa.core import db, sentinel
+from pybossa.util import admin_required, Pagination
+from pybossa.core import db, sentinel, csrf
+from collections import OrderedDict
 import json
 import datetime
+import calendar
+import time
 import base64, hashlib, random
 
 blueprint = Blueprint("geotagx-sourcerer", __name__)
 
+SOURCERER_HASH_KEY = "GEOTAGX-SOURCERER-HASH"
+"""The key to the Redis hash that holds every image ever collected via the sourcerers."""
+
+SOURCERER_QUEUE_KEY = "GEOTAGX-SOURCERER-HASHQUEUE"
+"""The key to the Redis hash that holds the images waiting to be approved or rejected."""
+
+SOURCERER_QUEUE_INDEX_KEY = "GEOTAGX-SOURCERER-QUEUE-INDEX"
+"""The key to the Redis sorted set that orders the queued images by their time of arrival."""
+
+DASHBOARD_PAGE_SIZE = 50
+"""The number of queued images listed on each page of the dashboard."""
+
+INGEST_SCRIPT = """
+local results = {}
+for i = 1, #ARGV, 3 do
+    if redis.call("HSETNX", KEYS[1], ARGV[i], ARGV[i + 1]) == 1 then
+        redis.call("HSET", KEYS[2], ARGV[i], ARGV[i + 1])
+        redis.call("ZADD", KEYS[3], ARGV[i + 2], ARGV[i])
+        results[#results + 1] = 1
+    else
+        results[#results + 1] = 0
+    end
+end
+return results
+"""
+"""A Lua script that saves each given <image URL, data, arrival time> triple that has not yet been seen, and queues it."""
+
 
 """
     Basic implementation of the geotagx-sourcerer-proxy which ingests images from multiple sources
@@ -45,17 +76,8 @@ blueprint = Blueprint("geotagx-sourcerer", __name__)
 def proxy():
     data = request.args.get('sourcerer-data')
     try:
-        data = base64.b64decode(data)
-        data = json.loads(data)
-        data['timestamp'] = str(datetime.datetime.utcnow())
-        image_url = data['image_url']
-
-        # The "GEOTAGX-SOURCERER-HASH" key represents the overall knowledge of GeoTagX about all the images collected via sourcerers
-        hsetnx_response = sentinel.slave.hsetnx("GEOTAGX-SOURCERER-HASH", image_url, json.dumps(data))
-        if hsetnx_response == 1: # Case when the image_url has not yet been seen
-            # Save it into a "Queue" modelled as a hash, where it waits until the admin approves or rejects it
-            sentinel.slave.hsetnx("GEOTAGX-SOURCERER-HASHQUEUE", image_url, json.dumps(data))
-
+        data = parse_payload(data)
+        ingest([(data['image_url'], json.dumps(data))])
 
         response = {}
         response['state'] = "SUCCESS"
@@ -69,6 +91,95 @@ def proxy():
         response['message'] = str(e)
         return jsonify(response)
 
+
+"""
+    Batch implementation of the geotagx-sourcerer-proxy. It accepts a JSON array of
+    sourcerer payloads, i.e. the base64-encoded values of the proxy's "sourcerer-data"
+    parameter, and returns the outcome of each payload in the same order. Its clients,
+    e.g. browser extensions and scrapers, hold no CSRF token, so it is exempt from
+    the CSRF protection, like PyBossa's API
+"""
+@blueprint.route('/proxy/batch', methods = ['POST'])
+@csrf.exempt
+def proxy_batch():
+    payloads = request.get_json(force=True, silent=True)
+    if not isinstance(payloads, list):
+        abort(400)
+    if len(payloads) > current_app.config['GEOTAGX_SOURCERER_MAX_BATCH_SIZE']:
+        abort(413)
+
+    results = [None] * len(payloads)
+    items, positions = [], []
+    for (i, payload) in enumerate(payloads):
+        try:
+            data = parse_payload(payload)
+            items.append((data['image_url'], json.dumps(data)))
+            positions.append(i)
+            results[i] = {"state": "SUCCESS", "data": data}
+        except Exception as e:
+            results[i] = {"state": "ERROR", "message": str(e)}
+
+    try:
+        for (i, queued) in zip(positions, ingest(items)):
+            results[i]['queued'] = queued
+    except Exception as e:
+        response = {}
+        response['state'] = "ERROR"
+        response['message'] = str(e)
+        return jsonify(response)
+
+    response = {}
+    response['state'] = "SUCCESS"
+    response['results'] = results
+    return jsonify(response)
+
+
+def parse_payload(payload):
+    """Decodes the specified sourcerer payload and timestamps it.
+
+    Args:
+        payload (str): A base64-encoded JSON object that contains at least an "image_url" field.
+
+    Returns:
+        dict: The payload's data.
+
+    Raises:
+        TypeError: If the payload can not be decoded.
+        ValueError: If the payload is not a valid JSON object, or has no image URL.
+    """
+    data = json.loads(base64.b64decode(payload))
+    if not isinstance(data, dict) or not data.get('image_url'):
+        raise ValueError("The payload has no image URL.")
+
+    data['timestamp'] = str(datetime.datetime.utcnow())
+    data['id'] = hashlib.md5(data['image_url']).hexdigest()
+    return data
+
+
+def ingest(items):
+    """Saves and queues the specified sourcerer items that have not yet been seen.
+
+    The "GEOTAGX-SOURCERER-HASH" key represents the overall knowledge of GeoTagX about all
+    the images collected via sourcerers. Unseen images are also saved into a "Queue" modelled
+    as a hash, where they wait until the admin approves or rejects them, and indexed by their
+    time of arrival. The writes are made atomically, in a single round trip, by a server-side script.
+
+    Args:
+        items (list): A list of <image URL, JSON-encoded data> pairs.
+
+    Returns:
+        list: A list of booleans set to True for each item that had not yet been seen.
+    """
+    if not items:
+        return []
+
+    script = sentinel.master.register_script(INGEST_SCRIPT)
+    keys = [SOURCERER_HASH_KEY, SOURCERER_QUEUE_KEY, SOURCERER_QUEUE_INDEX_KEY]
+    now = time.time()
+    arguments = [value for (image_url, data) in items for value in (image_url, data, now)]
+    return [result == 1 for result in script(keys=keys, args=arguments)]
+
+
 """
     End point to get meta data about Categories for which data is being collected via
     geotagx-sourcerers
@@ -87,20 +198,90 @@ def categories():
     which lets admins push contributed images directly into the projects
     (via the GeoTag-X Sourcerer Sink Daemon)
 """
-@blueprint.route('/settings')
+@blueprint.route('/settings', defaults={'page': 1})
+@blueprint.route('/settings/page/<int:page>')
 @login_required
 @admin_required
-def dashboard():
-    queue = sentinel.slave.hgetall("GEOTAGX-SOURCERER-HASHQUEUE")
-    #TODO : Handle Exception
-    queue_object = {}
-    for _key in queue.keys():
-        _obj = json.loads(queue[_key])
-        _m = hashlib.md5()
-        _m.update(_obj['image_url'])
-        _obj['id'] = _m.hexdigest()
+def dashboard(page):
+    if page < 1:
+        abort(404)
+
+    index_queue()
+
+    # Only the page's images are read from the queue, in their order of arrival.
+    total = sentinel.master.zcard(SOURCERER_QUEUE_INDEX_KEY)
+    start = (page - 1) * DASHBOARD_PAGE_SIZE
+    image_urls = sentinel.master.zrange(SOURCERER_QUEUE_INDEX_KEY, start, start + DASHBOARD_PAGE_SIZE - 1)
+    values = sentinel.master.hmget(SOURCERER_QUEUE_KEY, image_urls) if image_urls else []
+
+    queue_object = OrderedDict()
+    for (_key, _value) in zip(image_urls, values):
+        if _value is None:
+            continue
+        _obj = json.loads(_value)
+        # Images queued before their identifier was stored at ingest.
+        if 'id' not in _obj:
+            _obj['id'] = hashlib.md5(_obj['image_url']).hexdigest()
         queue_object[_key] = _obj
-    return render_template('geotagx/sourcerer/dashboard.html', queue = queue_object)
+
+    if not queue_object and page != 1:
+        abort(404)
+
+    pagination = Pagination(page, DASHBOARD_PAGE_SIZE, total)
+    return render_template('geotagx/sourcerer/dashboard.html', queue = queue_object, pagination = pagination)
+
+
+def index_queue():
+    """Indexes the queued images that are missing from the queue's index.
+
+    Images queued before the index was introduced are indexed by their timestamp.
+    The queue is only scanned when the index and queue sizes differ.
+    """
+    pipeline = sentinel.master.pipeline()
+    pipeline.hlen(SOURCERER_QUEUE_KEY)
+    pipeline.zcard(SOURCERER_QUEUE_INDEX_KEY)
+    n_queued, n_indexed = pipeline.execute()
+    if n_queued == n_indexed:
+        return
+
+    queued = set()
+    pipeline = sentinel.master.pipeline()
+    for (image_url, value) in sentinel.master.hscan_iter(SOURCERER_QUEUE_KEY):
+        queued.add(image_url)
+        try:
+            timestamp = datetime.datetime.strptime(json.loads(value)['timestamp'], "%Y-%m-%d %H:%M:%S.%f")
+            score = calendar.timegm(timestamp.utctimetuple()) + timestamp.microsecond / 1e6
+        except (KeyError, ValueError):
+            score = 0
+        pipeline.zadd(SOURCERER_QUEUE_INDEX_KEY, score, image_url)
+
+    # Drop the indexed images that are no longer queued.
+    for (image_url, _) in sentinel.master.zscan_iter(SOURCERER_QUEUE_INDEX_KEY):
+        if image_url not in queued:
+            pipeline.zrem(SOURCERER_QUEUE_INDEX_KEY, image_url)
+
+    pipeline.execute()
+
+def notify_new_tasks(project_ids):
+    """Announces the new tasks of the specified projects, and cleans the projects' cached data.
+
+    This is what the Task model's after_insert listeners do for each task that is
+    created through the ORM, except that it is done once per project rather than
+    once per task: a single feed entry is added for each project, as the entries
+    the listeners add for a project's tasks are identical.
+
+    Args:
+        project_ids (iterable): The identifiers of the projects whose tasks were created.
+    """
+    from pybossa.cache import projects as cached_projects
+    from pybossa.feed import update_feed
+
+    query = db.session.query(Project.id, Project.name, Project.short_name, Project.info)\
+                      .filter(Project.id.in_(project_ids))
+    for (project_id, name, short_name, info) in query:
+        update_feed({"id": project_id, "name": name, "short_name": short_name, "info": info, "action_updated": "Task"})
+        cached_projects.clean_project(project_id)
+
 
 @blueprint.route('/commands', methods = ['POST'])
 @login_required
@@ -117,42 +298,56 @@ def dashboard_commands():
         if "reject" in commands.keys():
             reject = commands['reject']
 
+        # Resolve the approved items' categories to their projects with a single query
+        category_names = set(_category for _item in approve for _category in _item['categories'])
+        related_projects = {}
+        if category_names:
+            query = db.session.query(Category.short_name, Project.id)\
+                              .join(Project, Project.category_id == Category.id)\
+                              .filter(Category.short_name.in_(category_names))
+            for (category_name, project_id) in query:
+                related_projects.setdefault(category_name, []).append(project_id)
+
         # Deal with Approved Items
+        tasks = []
         for _item in approve:
-            _categories = _item['categories']
             IMAGE_URL = _item['image_url']
             SOURCE_URI = _item['source_uri']
 
-            for _category in _categories:
-                category_objects = Category.query.filter(Category.short_name == _category)
-                for category_object in category_objects:
-                    related_projects = Project.query.filter(Project.category == category_object)
-                    for related_project in related_projects:
-                        # Start building Task Object
-                        _task_object = Task()
-                        _task_object.project_id = related_project.id
-
-                        # Build Info Object from whatever data we have
-                        _info_object = {}
-                        _info_object['image_url'] = IMAGE_URL
-                        _info_object['source_uri'] = SOURCE_URI
-                        _info_object['id'] = SOURCE_URI + "_" + \
-                                            ''.join(random.choice('0123456789ABCDEF') for i in range(16))
-
-                        _task_object.info = _info_object
-                        print _task_object
-                        print _info_object
-
-                        db.session.add(_task_object)
-                        db.session.commit()
-            # Delete from GEOTAGX-SOURCERER-HASHQUEUE
-            sentinel.slave.hdel("GEOTAGX-SOURCERER-HASHQUEUE", IMAGE_URL)
-
-        # Deal with rejected items
-        for _item in reject:
-            #Directly delete from GEOTAGX-SOURCERER-HASHQUEUE
-            IMAGE_URL = _item['image_url']
-            sentinel.slave.hdel("GEOTAGX-SOURCERER-HASHQUEUE", IMAGE_URL)
+            for _category in _item['categories']:
+                for project_id in related_projects.get(_category, []):
+                    # Build Info Object from whatever data we have
+                    _info_object = {}
+                    _info_object['image_url'] = IMAGE_URL
+                    _info_object['source_uri'] = SOURCE_URI
+                    _info_object['id'] = SOURCE_URI + "_" + \
+                                        ''.join(random.choice('0123456789ABCDEF') for i in range(16))
+
+                    tasks.append({"project_id": project_id, "info": _info_object})
+
+        # Create every task with a single bulk insert, in one transaction. The insert bypasses
+        # the Task model's event listeners, so their work is done by notify_new_tasks instead.
+        if tasks:
+            project_ids = set(_task['project_id'] for _task in tasks)
+            try:
+                db.session.execute(Task.__table__.insert(), tasks)
+                db.session.query(Project)\
+                          .filter(Project.id.in_(project_ids))\
+                          .update({Project.updated: make_timestamp()}, synchronize_session=False)
+                db.session.commit()
+            except:
+                db.session.rollback()
+                raise
+
+            notify_new_tasks(project_ids)
+
+        # Delete the approved and rejected items from GEOTAGX-SOURCERER-HASHQUEUE and its index
+        image_urls = [_item['image_url'] for _item in approve + reject]
+        if image_urls:
+            pipeline = sentinel.master.pipeline()
+            pipeline.hdel(SOURCERER_QUEUE_KEY, *image_urls)
+            pipeline.zrem(SOURCERER_QUEUE_INDEX_KEY, *image_urls)
+            pipeline.execute()
 
         _result = {
             "result" : "SUCCESS"